@@ -1,15 +1,19 @@
 # coding=utf-8
 
 import abc
+import contextlib
 import datetime
+import functools
 import io
 import logging
 import importlib
+import threading
+import time
+from collections import namedtuple
 from pathlib import Path
-from queue import Queue
 from string import Template
-from typing import Optional, Iterable, Generator
-from multiprocessing import Pool
+from typing import Any, Optional, Iterable, Generator, Tuple, List
+from multiprocessing.pool import Pool
 
 
 import requests
@@ -17,8 +21,14 @@ import requests
 import arcturus.ArcturusSources.Source as Source
 from .import ArcturusSources
 from .Blacklist import Blacklist
+from .Cache import Cache
+from .FileSink import SyncGroup, write_part
+from .Manifest import Manifest
+from .PendingQueue import PendingQueue
+from .pool import worker_pool
+from .SizePolicy import SizePolicy
 from .Post import Post
-from .Taglist import Query
+from .Taglist import Query, CoalescedQuery, Taglist
 
 NAME = "Arcturus"
 
@@ -31,6 +41,46 @@ PYTHON_REQUIRED_MINOR = 6
 class ArcturusError(Exception):
     """base exception class for all Arcturus exceptions"""
 
+
+# what a download method is given: the file's url, where to save it and its size in bytes (None if unknown)
+DownloadJob = namedtuple('DownloadJob', ['url', 'destination', 'size'])
+
+# what a download method returns: bytes written and seconds taken
+DownloadResult = namedtuple('DownloadResult', ['url', 'destination', 'size', 'elapsed'])
+
+
+def _download_single(job: DownloadJob) -> DownloadResult:
+    """
+    downloads a single file
+
+    the file is left as a part file next to its destination.  the main process moves it into place once it is durable
+
+    :param job: the file to download
+    :return:    the number of bytes downloaded and how long it took
+    """
+    start = time.monotonic()
+    # responses are only context managers from requests 2.18
+    with contextlib.closing(requests.get(job.url, stream=True)) as response:
+        response.raise_for_status()
+        size = job.size or int(response.headers.get('Content-Length', 0)) or None
+        _, written = write_part(job.destination, response.iter_content(chunk_size=64 * 1024), size)
+    return DownloadResult(job.url, job.destination, written, time.monotonic() - start)
+
+
+def _try_download(download_method, job: DownloadJob) -> Tuple[DownloadJob, Optional[DownloadResult], Optional[str]]:
+    """
+    runs a download method, catching any error so that one bad file doesn't stop the rest
+
+    :param download_method: function which downloads the job
+    :param job:             the file to download
+    :return:                tuple of (job, result or None, error message or None)
+    """
+    try:
+        return job, download_method(job), None
+    except Exception as err:
+        return job, None, f"{type(err).__name__}: {err}"
+
+
 class ArcturusCore:
     """central class of the program which takes configuration information and downloads from a data source"""
 
@@ -40,14 +90,14 @@ class ArcturusCore:
                  download_dir: Path,
                  lastrun: Optional[datetime.date],
                  blacklist: Optional[Blacklist],
-                 cache: Optional[io.TextIOBase],
+                 cache: Optional[Cache],
                  **kwargs
                  ):
 
         # required args
         self._source = source
         self._taglist = taglist
-        self._download_dir = download_dir
+        self._download_dir = Path(download_dir)
 
         # optional args
         self._lastrun = lastrun
@@ -55,52 +105,263 @@ class ArcturusCore:
         self._cache = cache
         self._threads = kwargs.get('download_threads', 4)
         self._nameformat = kwargs.get('download_nameformat', "${artist}_${md5}.${ext}")
+        self._coalesce = kwargs.get('query_coalescing', False)
+        self._pending_dir = kwargs.get('pending_dir', None)
+        self._batch_size = kwargs.get('download_batch_size', 64)
+        self._size_policy = kwargs.get('size_policy', SizePolicy())
+        self._recorder = kwargs.get('recorder', None)
+        self._sync = SyncGroup(kwargs.get('sync_batch_size', 64), on_commit=self._committed)
+        self._listed_md5s = {}  # destination -> md5 of the listed post, for files still being downloaded
         self._kwargs = kwargs
 
         self._log = logging.getLogger()
 
-        # attributes
-        self._pending_downloads = Queue()
-
     @classmethod
     def import_arcturus_source(cls, source_name):
         return importlib.import_module(f'.ArcturusSources.{source_name}', __package__)
 
+    def _listings(self) -> Iterable[CoalescedQuery]:
+        if self._coalesce:
+            return Taglist.coalesce(self._taglist, self._source.max_query_tags)
+        return [CoalescedQuery(x.text, (x,), x.ignore_lastrun) for x in self._taglist]
+
+    def _split_coalesced(self, listing: CoalescedQuery, posts: Iterable[Post]) -> Generator[Post, None, None]:
+        # a post from a merged listing belongs to every member query whose tag it carries
+        for post in posts:
+            tag_set = set(post.tags)
+            for member in listing.members:
+                if member.text.lower() in tag_set:
+                    yield post.for_query(member.text, member.alias)
+
+    def _select(self, post: Post) -> Optional[Post]:
+        # these are the individual images / movies / files
+
+        # it has been previously downloaded.  don't download it again
+        if self._cache and post.md5 in self._cache:
+            return None
+
+        # if we have a blacklist and this shouldn't be downloaded based on it, skip it
+        if self._blacklist and self._blacklist.is_blacklisted(post.tags, post.to_dict()):
+            return None
+
+        # pick the variant to download, or skip it if none fit the size cap and byte budget
+        return self._size_policy.select(post)
+
+    def _get_pages(self, listing: CoalescedQuery, after: Any = None) -> Generator[Tuple[Any, List[Post]], None, None]:
+        lastrun = self._lastrun
+        if listing.ignore_lastrun:
+            lastrun = None
+
+        if len(listing.members) == 1:
+            query = listing.members[0]
+            pages = self._source.get_pages(query=query.text, alias=query.alias, lastrun=lastrun, after=after)
+        else:
+            pages = ((cursor, list(self._split_coalesced(listing, posts)))
+                     for cursor, posts in self._source.get_pages(query=listing.text, alias=None, lastrun=lastrun,
+                                                                 after=after))
+
+        for cursor, posts in pages:
+            selected = (self._select(x) for x in posts)
+            yield cursor, [x for x in selected if x is not None]
+
     def _get_posts(self) -> Generator[Post, None, None]:
-        for line in self._taglist:
-            lastrun = self._lastrun
-            if line.ignore_lastrun:
-                lastrun = None
-            for post in self._source.get_posts(query=line.text, alias=line.alias, lastrun=lastrun):
+        for listing in self._listings():
+            for _, posts in self._get_pages(listing):
+                yield from posts
+
+    def _queue_posts(self, pending: PendingQueue, stop: threading.Event):
+        for listing in self._listings():
+            key = repr(listing)
+            cursor, done = pending.progress(key)
+            if done:
+                continue
+
+            for cursor, posts in self._get_pages(listing, after=cursor):
+                for post in posts:
+                    self._print_post(post)
+                pending.append(posts, key, cursor, charged=self._size_policy.spent)
 
-                # these are the individual images / movies / files
+                # the listing is resumed from this page next time
+                if stop.is_set():
+                    return
 
-                # it has been previously downloaded.  don't download it again
-                if self._cache and post.md5 in self._cache:
-                    continue
+            pending.finish(key)
 
-                # if we have a blacklist and this shouldn't be downloaded based on it, skip it
-                if self._blacklist and self._blacklist.is_blacklisted(post.tags):
-                    continue
+    def _destination(self, post: Post) -> Path:
+        fields = post.to_dict()
+        fields['artist'] = post.alias or post.query
+        filename = Template(self._nameformat).safe_substitute(fields)
+        return self._download_dir / Path(filename)
 
-                yield post
+    def _job(self, post: Post) -> DownloadJob:
+        return DownloadJob(post.url, self._destination(post), post.file_size)
 
-    def _download_single(self, post: Post):
+    def _download_all(self, pool: Pool, jobs: Iterable[DownloadJob], download_method) -> int:
+        # a failed file is logged and skipped, so it can't stop the run (or, in a pending queue, stop its batch from
+        # ever being checkpointed).  it is listed again by the next update which still finds it
+        count = 0
+        for job, result, error in pool.imap_unordered(functools.partial(_try_download, download_method), jobs):
+            if error is not None:
+                self._log.warning(f"failed to download {job.url}: {error}")
+                self._listed_md5s.pop(job.destination, None)
+                continue
+            self._finished(result)
+            count += 1
+        return count
 
-        filename = Template(self._nameformat).substitute(post.__dict__)
-        destination = self._download_dir / Path(filename)
-        response = requests.get(post.url, stream=True)
-        handle = open(destination, "wb")
-        for chunk in response.iter_content(chunk_size=512):
-            if chunk:  # filter out keep-alive new chunks
-                handle.write(chunk)
+    def _finished(self, result: DownloadResult):
+        # download methods which don't write anything (e.g. replays) return no destination
+        if result.destination is not None:
+            self._sync.add(result.destination)
+
+        if self._recorder is not None:
+            self._recorder.record_file(result)
+
+    def _committed(self, destinations: List[Path]):
+        # the listed md5 is cached rather than the file's own, which differs when the size policy chose a sample or
+        # preview.  that way the post is recognized as downloaded the next time it is listed
+        for destination in destinations:
+            md5 = self._listed_md5s.pop(destination, None)
+            if md5 is not None:
+                self._cache.add(md5)
 
     def _print_post(self, post: Post):
         print(post.url)
 
-    def update(self, namefmt: Optional[str], download_method=_download_single):
-        for x in self._get_posts():
-            print(x)
+    def _read_manifests(self, manifests: Iterable[Path]) -> Generator[Post, None, None]:
+        destinations = set()
+        for manifest in manifests:
+            with open(manifest) as fp:
+                for post in Manifest.read(fp):
+
+                    # manifests may overlap (e.g. a retried plan), but each file only needs to be fetched once
+                    destination = self._destination(post)
+                    if destination in destinations:
+                        continue
+                    destinations.add(destination)
+
+                    # it may have been downloaded since the manifest was written
+                    if self._cache and post.md5 in self._cache:
+                        continue
+
+                    # the size caps and byte budget apply to this run, whatever they were when the manifest was planned
+                    post = self._size_policy.select(post)
+                    if post is not None:
+                        yield post
+
+    def _unique_jobs(self, posts: Iterable[Post], destinations: set) -> Generator[DownloadJob, None, None]:
+        # two workers writing the same part file at once would corrupt it, so each destination is only fetched once.
+        # a file is only ever at its destination once it is complete, so one that is already there (e.g. from an
+        # execute which was interrupted and retried) isn't fetched again
+        for post in posts:
+            job = self._job(post)
+            if job.destination in destinations or job.destination.exists():
+                continue
+            destinations.add(job.destination)
+            if self._cache is not None:
+                self._listed_md5s[job.destination] = post.md5
+            yield job
+
+    def _download(self, posts: Iterable[Post], download_method) -> int:
+        jobs = self._unique_jobs(posts, set())
+        count = 0
+        try:
+            with worker_pool(self._threads) as pool:
+                count = self._download_all(pool, jobs, download_method)
+        finally:
+            self._sync.commit()
+        return count
+
+    def _download_pending(self, pending: PendingQueue, download_method) -> int:
+        # listing runs on its own thread, appending to the queue while this thread downloads from it.  the pool is only
+        # ever given one batch, so memory use doesn't depend on the size of the queue
+        # every file in a batch is committed before the batch is checkpointed as downloaded, so only files in the same
+        # batch can be written at the same time
+        stop = threading.Event()
+        errors = []
+
+        def list_posts():
+            try:
+                self._queue_posts(pending, stop)
+            except BaseException as err:
+                errors.append(err)
+            finally:
+                pending.end_listing()
+
+        lister = threading.Thread(target=list_posts, name="listing", daemon=True)
+        count = 0
+        try:
+            with worker_pool(self._threads) as pool:
+                # started after the pool so that no worker is forked while the listing thread holds a lock
+                lister.start()
+                for posts in pending.batches(self._batch_size):
+                    jobs = list(self._unique_jobs(posts, set()))
+                    count += self._download_all(pool, jobs, download_method)
+                    self._sync.commit()
+        finally:
+            stop.set()
+            if lister.ident is not None:
+                lister.join()
+            self._sync.commit()
+
+        if errors:
+            raise errors[0]
+        return count
+
+    def plan(self, manifest: io.TextIOBase) -> int:
+        """
+        lists and filters every taglist query exactly once, streaming the posts that would be downloaded to a manifest
+
+        :param manifest:    text file to write the manifest to
+        :return:            number of posts written
+        """
+        return Manifest.write(self._get_posts(), manifest)
+
+    def execute(self, manifests: Iterable[Path], download_method=_download_single) -> int:
+        """
+        downloads the posts in one or more manifests written by plan.  the listing api is not used at all
+
+        :param manifests:       paths of the manifests to download
+        :param download_method: function used (in a worker process) to download each DownloadJob
+        :return:                number of files downloaded
+        """
+        return self._download(self._read_manifests(manifests), download_method)
+
+    def update(self, namefmt: Optional[str] = None, download_method=_download_single) -> int:
+        """
+        lists, filters and downloads every taglist query
+
+        without a pending_dir, this is a single pass and downloads start while listing is still in progress.  with one,
+        every post is queued on disk, with a checkpoint after every page, and downloaded from the queue in checkpointed
+        batches while listing carries on.  if the run dies, the next update with the same pending_dir carries on from
+        the last checkpoint
+
+        :param namefmt:         overrides the name format given when the core was created
+        :param download_method: function used (in a worker process) to download each DownloadJob
+        :return:                number of files downloaded
+        """
+        if namefmt:
+            self._nameformat = namefmt
+
+        if self._pending_dir is None:
+            def announced(posts):
+                for post in posts:
+                    self._print_post(post)
+                    yield post
+
+            return self._download(announced(self._get_posts()), download_method)
+
+        pending = PendingQueue(self._pending_dir)
+        if pending.resumed:
+            self._log.info(f"resuming unfinished run from {self._pending_dir}")
+            # the posts already queued were charged to the byte budget by the run which queued them
+            self._size_policy.charge(pending.charged)
+
+        try:
+            count = self._download_pending(pending, download_method)
+        except BaseException:
+            pending.close()
+            raise
 
-        p = Pool(1)
-        p.map(download_method, self._get_posts())
+        pending.clear()
+        return count
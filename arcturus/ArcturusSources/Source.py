@@ -1,21 +1,26 @@
 from abc import ABC, abstractmethod
 from datetime import date
-from typing import Optional, Generator
+from typing import Any, Optional, Generator, List, Tuple
 from arcturus.Blacklist import Blacklist
 from arcturus.Post import Post
+from arcturus.PostIndex import PostIndex
+
+PAGE_SIZE = 100
 
 class Source(ABC):
     def __init__(self,
                  date: Optional[date] = None,
                  blacklist: Optional[Blacklist] = None,
                  username: Optional[str] = None,
-                 password: Optional[str] = None
+                 password: Optional[str] = None,
+                 index: Optional[PostIndex] = None
                  ):
 
         self._date = date
         self._blacklist = blacklist
         self._username = username
         self._password = password
+        self._index = index
 
     @property
     def date(self):
@@ -25,6 +30,16 @@ class Source(ABC):
     def blacklist(self):
         return self._blacklist
 
+    @property
+    def index(self):
+        """local index that every listed post is written into, if any"""
+        return self._index
+
+    @property
+    def max_query_tags(self) -> int:
+        """the most tags a single listing request may contain.  sources which don't support OR queries return 1"""
+        return 1
+
     @property
     def namefmt(self):
         return self._namefmt
@@ -32,3 +47,27 @@ class Source(ABC):
     @abstractmethod
     def get_posts(self, query: str, alias: Optional[str], lastrun=None) -> Generator[Post, None, None]:
         pass
+
+    def get_pages(self, query: str, alias: Optional[str], lastrun=None,
+                  after: Any = None) -> Generator[Tuple[Any, List[Post]], None, None]:
+        """
+        lists the same posts as get_posts, one page at a time, so that listing can be resumed part way through
+
+        each page comes with a cursor: a json-serializable value which, passed back as after, resumes listing with the
+        page following it.  sources with real paging should override this.  the default splits get_posts into pages of
+        PAGE_SIZE, numbered from 1, which only resumes correctly if get_posts returns the same posts in the same order
+        every time
+
+        :param after:   cursor of the last page already listed, or None to start from the beginning
+        :return:        generator of (cursor, posts on that page)
+        """
+        page_num, posts = 1, []
+        for post in self.get_posts(query, alias, lastrun):
+            posts.append(post)
+            if len(posts) == PAGE_SIZE:
+                if after is None or page_num > after:
+                    yield page_num, posts
+                page_num, posts = page_num + 1, []
+
+        if posts and (after is None or page_num > after):
+            yield page_num, posts
@@ -1,17 +1,21 @@
 # coding=utf-8
 
-from datetime import datetime
-from typing import Optional, Generator
-from ..Post import Post
+from datetime import date, datetime, timezone
+from typing import Optional, Generator, List, Tuple
+from ..Post import Post, Variant, ORIGINAL, SAMPLE, PREVIEW
 from ..Blacklist import Blacklist
+from ..PostIndex import PostIndex
 from .Source import Source
 import requests
 import os.path
 import logging
+import time
 from ..version import VERSION
 from ..ArcturusCore import NAME
+from ..Cassette import CassetteRecorder
 
 USER_AGENT = f"{NAME}/{VERSION} (by wwyaiykycnf1)"
+MAX_QUERY_TAGS = 6
 
 
 class source(Source):
@@ -20,45 +24,112 @@ class source(Source):
                  date: Optional[date] = None,
                  blacklist: Optional[Blacklist] = None,
                  username: Optional[str] = None,
-                 password: Optional[str] = None):
+                 password: Optional[str] = None,
+                 index: Optional[PostIndex] = None,
+                 recorder: Optional[CassetteRecorder] = None):
 
-        super().__init__(date, blacklist, username, password)
+        super().__init__(date, blacklist, username, password, index)
+        self._recorder = recorder
         self._list_url = 'https://e621.net/post/index.json?'
         self._session = requests.Session()
         self._session.headers.update({'User-Agent': USER_AGENT})
 
+    @property
+    def max_query_tags(self) -> int:
+        return MAX_QUERY_TAGS
 
     def get_posts(self, query: str, alias: Optional[str], lastrun=None) -> Generator[Post, None, None]:
+        for _, posts in self.get_pages(query, alias, lastrun):
+            yield from posts
+
+    def get_pages(self, query: str, alias: Optional[str], lastrun=None,
+                  after: Optional[int] = None) -> Generator[Tuple[int, List[Post]], None, None]:
+        """
+        pages through a query by post id, newest first.  each page's cursor is the lowest id on it, and the next page
+        is requested with before_id set to that id.  unlike page numbers, this stays put when posts are added or
+        removed while listing, so a resumed listing neither repeats nor skips posts
+
+        :param after:   cursor (lowest post id) of the last page already listed, or None to start with the newest post
+        """
+        before_id = after
         while True:
-            results = self._get_page(query, 0)
+            results = self._get_page(query, before_id)
 
             if len(results) == 0:
                 break
 
+            posts = []
             for result in results:
-                if lastrun and lastrun < self._get_created_at_datetime(result):
-                    yield self._make_post(result)
+                post = self._make_post(result, query, alias)
+
+                # everything listed is indexed, even posts too old to be downloaded this time
+                if self._index is not None:
+                    self._index.add(post)
+
+                if lastrun is None or lastrun < self._get_created_at_datetime(result):
+                    posts.append(post)
+
+            before_id = min(result["id"] for result in results)
+            yield before_id, posts
+
+            # pages are newest first, so once a page reaches back to lastrun every later page is older still
+            if lastrun is not None and min(self._get_created_at_datetime(x) for x in results) <= lastrun:
+                break
+
+        if self._index is not None:
+            self._index.flush()
 
     def _get_created_at_datetime(self, metadata) -> datetime:
-        return datetime.utcfromtimestamp(metadata['created_at']['s'])
+        return datetime.fromtimestamp(metadata['created_at']['s'], tz=timezone.utc)
+
+    def _make_post(self, metadata, query: Optional[str] = None, alias: Optional[str] = None):
+        tags = metadata["tags"]
+        if isinstance(tags, str):
+            tags = tags.split()
 
-    def _make_post(self, metadata):
         return Post(url=metadata["file_url"],
-                    tags=metadata["tags"],
+                    tags=tags,
                     md5=metadata["md5"],
                     filename=os.path.basename(metadata["file_url"]),
-                    ext=metadata["file_ext"]
+                    ext=metadata["file_ext"],
+                    query=query,
+                    alias=alias,
+                    created_at=metadata["created_at"]["s"],
+                    rating=metadata.get("rating"),
+                    score=metadata.get("score"),
+                    file_size=metadata.get("file_size"),
+                    variants=self._get_variants(metadata)
                     )
 
-    def _get_page(self, query_str: str, page_num: int):
+    def _get_variants(self, metadata):
+        variants = {ORIGINAL: Variant(metadata["file_url"], metadata.get("file_size"),
+                                      metadata.get("width"), metadata.get("height"))}
+
+        # sample and preview sizes aren't reported by the api
+        for name, prefix in ((SAMPLE, "sample"), (PREVIEW, "preview")):
+            url = metadata.get(f"{prefix}_url")
+            if url and url != metadata["file_url"]:
+                variants[name] = Variant(url, None, metadata.get(f"{prefix}_width"), metadata.get(f"{prefix}_height"))
+
+        return variants
+
+    def _get_page(self, query_str: str, before_id: Optional[int]):
         log = logging.getLogger()
-        url = f'{self._list_url}tags={query_str}&page={page_num}'
-        log.debug(f"url: {url}")
+        url = f'{self._list_url}tags={query_str}'
+        if before_id is not None:
+            url += f'&before_id={before_id}'
+        log.debug("url: %s", url)
 
+        start = time.monotonic()
         response = self._session.get(url)
-        log.debug(f"response: status={response.status_code}: {response..reason}")
+        log.debug("response: status=%d: %s", response.status_code, response.reason)
 
         try:
-            return response.json()
+            body = response.json()
         except ValueError:
-            return {}
+            body = {}
+
+        if self._recorder is not None:
+            self._recorder.record_page(query_str, before_id, body, time.monotonic() - start)
+
+        return body
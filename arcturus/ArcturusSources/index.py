@@ -0,0 +1,35 @@
+# coding=utf-8
+"""offline source which answers queries from the local post index instead of the site"""
+
+import logging
+from datetime import date
+from typing import Optional, Generator
+from ..Post import Post
+from ..Blacklist import Blacklist
+from ..PostIndex import PostIndex
+from .Source import Source
+
+
+class source(Source):
+
+    def __init__(self,
+                 date: Optional[date] = None,
+                 blacklist: Optional[Blacklist] = None,
+                 username: Optional[str] = None,
+                 password: Optional[str] = None,
+                 index: Optional[PostIndex] = None):
+
+        super().__init__(date, blacklist, username, password, index)
+        if index is None:
+            raise ValueError("the index source requires an index to read from")
+
+    def get_posts(self, query: str, alias: Optional[str], lastrun=None) -> Generator[Post, None, None]:
+        try:
+            posts = self._index.query(query, lastrun)
+        except ValueError as err:
+            # answering without the term would list posts the site never would, so the query lists nothing instead
+            logging.getLogger().error(f"'{query}' can't be answered offline: {err}")
+            return
+
+        for post in posts:
+            yield post.for_query(query, alias)
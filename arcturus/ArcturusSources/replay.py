@@ -0,0 +1,44 @@
+# coding=utf-8
+"""offline source which replays e621 listing pages recorded in a cassette"""
+
+import logging
+import time
+from datetime import date
+from typing import Optional
+from ..Blacklist import Blacklist
+from ..Cassette import Cassette
+from ..PostIndex import PostIndex
+from . import e621
+
+
+class source(e621.source):
+    """
+    serves recorded pages in place of the site.  pages are delayed by the time they took to record divided by speed,
+    so speed=1 is real-time and speed=0 is unthrottled.  a page which wasn't recorded ends the listing
+    """
+
+    def __init__(self,
+                 date: Optional[date] = None,
+                 blacklist: Optional[Blacklist] = None,
+                 username: Optional[str] = None,
+                 password: Optional[str] = None,
+                 index: Optional[PostIndex] = None,
+                 cassette: Optional[Cassette] = None,
+                 speed: float = 1.0):
+
+        super().__init__(date, blacklist, username, password, index)
+        if cassette is None:
+            raise ValueError("the replay source requires a cassette to replay")
+        self._cassette = cassette
+        self._speed = speed
+
+    def _get_page(self, query_str: str, before_id: Optional[int]):
+        recorded = self._cassette.page(query_str, before_id)
+        if recorded is None:
+            logging.getLogger().debug("no recording of the page before id %s of '%s'", before_id, query_str)
+            return {}
+
+        body, elapsed = recorded
+        if self._speed:
+            time.sleep(elapsed / self._speed)
+        return body
@@ -1,6 +1,41 @@
 # coding=utf-8
 """classes/functions related to blacklist support"""
+import operator
 import typing
+from collections import namedtuple
+
+_NEG_PREFIX = '-'
+_OR_PREFIX = '~'
+_META_CHAR = ':'
+_COMMENT_CHAR = '#'
+_RANGE = '..'
+
+# a predicate takes a post's metadata and returns True/False, or None when the metadata needed is unavailable
+Predicate = typing.Callable[[typing.Mapping], typing.Optional[bool]]
+
+# one compiled blacklist line.  tag terms are sets, meta terms are predicates
+Rule = namedtuple('Rule', ['pos', 'neg', 'orr', 'meta', 'orr_meta'])
+
+# comparison prefixes allowed in numeric meta terms, longest first so that '<=' isn't read as '<'
+_COMPARISONS = [
+    ('<=', operator.le),
+    ('>=', operator.ge),
+    ('<', operator.lt),
+    ('>', operator.gt),
+    ('=', operator.eq),
+]
+
+# meta term name -> metadata key, for terms which compare numbers (score:<0, score:>=10, score:1..5, filesize:>10000000)
+_NUMERIC_FIELDS = {
+    'score': 'score',
+    'filesize': 'file_size',
+}
+
+# meta term name -> metadata key, for terms which match one of a fixed set of values (rating:s, type:webm)
+_ENUM_FIELDS = {
+    'rating': 'rating',
+    'type': 'ext',
+}
 
 
 class Blacklist:
@@ -9,61 +44,143 @@ class Blacklist:
 
     a post may be downloaded when it contains none of the blacklisted terms (or groups/combinations of terms on a single
     line of the blacklist).
+
+    every line is compiled once, when the blacklist is created, so checking a post is a single pass over the rules
     """
 
     def __init__(self, blacklist: typing.Iterable[str]):
-        self.blacklist = blacklist
-        self.parsed_lines = {}
+        self.blacklist = list(blacklist)
+        self._rules = [self.__compile_line(x) for x in self.blacklist
+                       if x.strip() and not x.strip().startswith(_COMMENT_CHAR)]
 
     def __len__(self):
         return sum(1 for _ in self.blacklist)
 
-    def is_blacklisted(self, tags: typing.Iterable[str]) -> bool:
+    def is_blacklisted(self, tags: typing.Iterable[str], metadata: typing.Optional[typing.Mapping] = None) -> bool:
         """
         check an item's attributes and return True or False indicating whether it is allowed based on the blacklist
-        :param tags:  the list of all attributes for an item as a list of strings
-        :return: True if item is allowed (aka not blacklisted) else False
+        :param tags:        the list of all attributes for an item as a list of strings
+        :param metadata:    the item's other fields (as returned by Post.to_dict), used by meta terms.  meta terms
+                            never match when this is not given
+        :return: True if item is blacklisted (aka not allowed) else False
         """
         tag_set = set(tags)
+        metadata = metadata or {}
+
+        for rule in self._rules:
+            if not rule.pos <= tag_set or rule.neg & tag_set:
+                continue
 
-        for line in self.blacklist:
-            blacklist_terms = self.__parse_terms(line)
+            if not all(predicate(metadata) is True for predicate in rule.meta):
+                continue
 
-            all_pos_tags_present = blacklist_terms["pos"] - tag_set == set()
-            no_neg_tags_present = blacklist_terms["neg"].intersection(tag_set) == set()
+            if (rule.orr or rule.orr_meta) and not (rule.orr & tag_set or
+                                                    any(predicate(metadata) is True for predicate in rule.orr_meta)):
+                continue
 
-            if all_pos_tags_present and no_neg_tags_present:
-                return True  # it was caught by the blacklist.  it is not allowed to be shown
+            return True  # it was caught by the blacklist.  it is not allowed to be shown
 
         return False  # nothing in the blacklist prevented it from being shown, so it is allowed
 
-    def __parse_terms(self, blacklist_line: str) -> typing.Dict[str, set]:
+    def __compile_line(self, blacklist_line: str) -> Rule:
         """
-        converts one line of the blacklist into a dict containing the terms and their types
+        converts one line of the blacklist into a rule
 
         a blacklist line may consist of several "types" of terms, which all have slightly different handling:
-        - "meta" terms have the ':' character in them and are mostly unsupported at this time (treated as pos terms)
+        - "meta" terms have the ':' character in them and compare a post's metadata rather than its tags (e.g. rating:e,
+          score:<0, score:1..10, type:webm).  they may be combined with the '-' and '~' prefixes below.  meta terms
+          which aren't understood are treated as ordinary tags
         - "neg" (negative) terms start with the '-' character.  if the term *IS NOT* in the post, the post is not shown
         - "orr" (OR) terms start with the '~' character.  if *ANY* of these terms are in the post, it is not shown
         - "pos" terms don't meet any of the above criteria. if *ALL* of these terms are in the post, it is not shown
 
         :param blacklist_line: line from blacklist file
-        :return: dictionary containing lists for each of the 4 types above
+        :return: compiled rule
         """
+        pos, neg, orr, meta, orr_meta = set(), set(), set(), [], []
+
+        for term in blacklist_line.split():
+            if term.startswith(_OR_PREFIX):
+                tags, predicates, term = orr, orr_meta, term[1:]
+            else:
+                tags, predicates = pos, meta
 
-        if blacklist_line not in self.parsed_lines:
+            negated = term.startswith(_NEG_PREFIX)
+            if negated:
+                term = term[1:]
 
-            parsed = {"pos": set(), "meta": set(), "neg": set()}
+            predicate = compile_meta(term) if _META_CHAR in term else None
 
-            for term in blacklist_line.split(' '):
-                if ':' in term:
-                    parsed["meta"].add(term)  # TODO: meta terms are not supported now ("meta" field is never checked)
-                    parsed["pos"].add(term)
-                elif term.startswith('-'):
-                    parsed["neg"].add(term[1:])
-                else:
-                    parsed["pos"].add(term)\
+            if predicate is not None:
+                predicates.append(_negate(predicate) if negated else predicate)
+            elif negated and tags is pos:
+                neg.add(term)
+            elif negated:
+                tags.add(_NEG_PREFIX + term)  # negated OR tags aren't supported, so they are matched literally
+            else:
+                tags.add(term)
 
-            self.parsed_lines[blacklist_line] = parsed
+        return Rule(frozenset(pos), frozenset(neg), frozenset(orr), tuple(meta), tuple(orr_meta))
 
-        return self.parsed_lines[blacklist_line]
+
+def compile_meta(term: str) -> typing.Optional[Predicate]:
+    """
+    compiles a meta term into a predicate over post metadata
+    :param term:    term of the form name:value, without any '-' or '~' prefix
+    :return:        predicate, or None if the term isn't a supported meta term
+    """
+    name, value = term.split(_META_CHAR, maxsplit=1)
+    name = name.lower()
+
+    if name in _ENUM_FIELDS:
+        return _enum_predicate(_ENUM_FIELDS[name], name, value.lower())
+
+    if name in _NUMERIC_FIELDS:
+        return _numeric_predicate(_NUMERIC_FIELDS[name], value)
+
+    return None
+
+
+def _negate(predicate: Predicate) -> Predicate:
+    def negated(metadata):
+        result = predicate(metadata)
+        return None if result is None else not result
+    return negated
+
+
+def _enum_predicate(key: str, name: str, value: str) -> Predicate:
+    # ratings may be written out in full (rating:explicit) but are stored as their first letter
+    if name == 'rating':
+        value = value[:1]
+
+    def predicate(metadata):
+        actual = metadata.get(key)
+        if actual is None:
+            return None
+        return str(actual).lower() == value
+    return predicate
+
+
+def _numeric_predicate(key: str, value: str) -> typing.Optional[Predicate]:
+    try:
+        if _RANGE in value:
+            low, high = (float(x) for x in value.split(_RANGE, maxsplit=1))
+            test = lambda x: low <= x <= high
+        else:
+            for prefix, compare in _COMPARISONS:
+                if value.startswith(prefix):
+                    target = float(value[len(prefix):])
+                    test = lambda x, compare=compare: compare(x, target)
+                    break
+            else:
+                target = float(value)
+                test = lambda x: x == target
+    except ValueError:
+        return None
+
+    def predicate(metadata):
+        actual = metadata.get(key)
+        if actual is None:
+            return None
+        return test(actual)
+    return predicate
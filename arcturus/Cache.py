@@ -0,0 +1,117 @@
+# coding=utf-8
+"""the cache records the md5 of every file which has been downloaded, so that it is never downloaded again"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import typing
+from pathlib import Path
+
+from .FileSink import PART_SUFFIX
+from .pool import worker_pool
+
+# (path relative to the download dir, full path, size in bytes, mtime in ns)
+ScanJob = typing.Tuple[str, Path, int, int]
+
+
+def _hash_file(job: ScanJob) -> typing.Tuple[str, int, int, typing.Optional[str]]:
+    """
+    computes the md5 of a file by mapping it into memory
+
+    :param job: tuple of (relative path, full path, size, mtime_ns) as found when walking the download dir
+    :return:    tuple of (relative path, size, mtime_ns, md5 hex digest).  the md5 is None if the file couldn't be read
+    """
+    relative, path, size, mtime_ns = job
+    try:
+        with open(path, 'rb') as fp:
+            if size == 0:  # empty files can't be mapped
+                return relative, size, mtime_ns, hashlib.md5().hexdigest()
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return relative, size, mtime_ns, hashlib.md5(mapped).hexdigest()
+    except (OSError, ValueError):  # deleted, unreadable, or emptied (can't be mapped) since it was found
+        return relative, size, mtime_ns, None
+
+
+class Cache:
+    """
+    set of md5s of previously downloaded files, saved as json
+
+    the cache also remembers the size and mtime of every file it found the last time the download dir was scanned, so
+    that a rebuild only hashes files which are new or have changed
+    """
+
+    def __init__(self, md5s: typing.Iterable[str] = (), scanned: typing.Optional[dict] = None):
+        self._md5s = set(md5s)
+        self._scanned = scanned or {}
+
+    def __len__(self):
+        return len(self._md5s)
+
+    def __contains__(self, md5: str) -> bool:
+        return md5 in self._md5s
+
+    def add(self, md5: str):
+        self._md5s.add(md5)
+
+    @classmethod
+    def load(cls, path: typing.Union[str, Path]) -> 'Cache':
+        with open(path) as fp:
+            contents = json.load(fp)
+        return cls(contents.get("cache", []), contents.get("scanned", {}))
+
+    def save(self, path: typing.Union[str, Path]):
+        """writes the cache to a temporary file and then replaces path with it, so a crash can't corrupt the cache"""
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w') as fp:
+            json.dump({"cache": sorted(self._md5s), "scanned": self._scanned}, fp)
+        os.replace(temp_path, path)
+
+    def rebuild(self, download_dir: Path, processes: typing.Optional[int] = None) -> int:
+        """
+        adds the md5 of every file in download_dir to the cache, hashing files in parallel
+
+        files whose size and mtime match the previous scan are not hashed again.  md5s already in the cache are kept,
+        even if their files are no longer in download_dir
+
+        :param download_dir:    folder to scan (recursively)
+        :param processes:       number of hashing processes (defaults to the number of cpus)
+        :return:                number of files which had to be hashed
+        """
+        log = logging.getLogger()
+        scanned = {}
+        jobs = []
+
+        for directory, _, filenames in os.walk(download_dir):
+            for filename in filenames:
+                if filename.endswith(PART_SUFFIX):  # unfinished download
+                    continue
+
+                path = Path(directory) / filename
+                relative = path.relative_to(download_dir).as_posix()
+                try:
+                    stat = path.stat()
+                except OSError as err:  # e.g. a broken symlink, or deleted since the folder was listed
+                    log.warning(f"skipping {relative}: {err}")
+                    continue
+
+                previous = self._scanned.get(relative)
+                if previous and previous[0] == stat.st_size and previous[1] == stat.st_mtime_ns:
+                    scanned[relative] = previous
+                else:
+                    jobs.append((relative, path, stat.st_size, stat.st_mtime_ns))
+
+        log.debug(f"{len(scanned)} files unchanged since the last scan, {len(jobs)} to hash")
+
+        if jobs:
+            with worker_pool(processes) as pool:
+                for relative, size, mtime_ns, md5 in pool.imap_unordered(_hash_file, jobs, chunksize=16):
+                    if md5 is None:
+                        log.warning(f"skipping {relative}: it could not be read")
+                        continue
+                    scanned[relative] = [size, mtime_ns, md5]
+
+        self._scanned = scanned
+        self._md5s.update(x[2] for x in scanned.values())
+        return len(jobs)
@@ -0,0 +1,136 @@
+# coding=utf-8
+"""
+recording and replaying of source traffic, so ArcturusCore can be run (and load-tested) without the network
+
+a cassette is a jsonl file.  each line is either a listing page, exactly as the site returned it, or the size and
+duration of a file download.
+"""
+
+import functools
+import io
+import json
+import threading
+import time
+import typing
+
+from .ArcturusCore import DownloadJob, DownloadResult
+from .FileSink import write_part
+
+_PAGE = 'page'
+_FILE = 'file'
+_SYNTHETIC_CHUNK = 1024 * 1024
+
+
+class CassetteRecorder:
+    """appends traffic to a cassette as it happens.  safe to share between the listing and downloading threads"""
+
+    def __init__(self, fp: io.TextIOBase):
+        self._fp = fp
+        self._lock = threading.Lock()
+
+    def _write(self, entry: dict):
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._fp.write(line)
+
+    def record_page(self, query: str, before_id: typing.Optional[int], body, elapsed: float):
+        """
+        :param query:       query text as sent to the site
+        :param before_id:   before_id as sent to the site, or None for the first page
+        :param body:        decoded json response
+        :param elapsed:     seconds the request took
+        """
+        self._write({"kind": _PAGE, "query": query, "before_id": before_id, "elapsed": elapsed, "body": body})
+
+    def record_file(self, result: DownloadResult):
+        self._write({"kind": _FILE, "url": result.url, "size": result.size, "elapsed": result.elapsed})
+
+    def close(self):
+        with self._lock:
+            self._fp.close()
+
+
+class Cassette:
+    """a loaded cassette, ready to be replayed"""
+
+    def __init__(self, pages: typing.Dict[typing.Tuple[str, typing.Optional[int]], typing.Tuple[typing.Any, float]],
+                 files: typing.Dict[str, typing.Tuple[int, float]]):
+        self._pages = pages
+        self._files = files
+
+    @classmethod
+    def load(cls, fp: typing.Iterable[str]) -> 'Cassette':
+        pages, files = {}, {}
+        for line in fp:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if entry["kind"] == _PAGE:
+                pages[(entry["query"], entry["before_id"])] = (entry["body"], entry["elapsed"])
+            elif entry["kind"] == _FILE:
+                files[entry["url"]] = (entry["size"], entry["elapsed"])
+        return cls(pages, files)
+
+    def page(self, query: str, before_id: typing.Optional[int]) -> typing.Optional[typing.Tuple[typing.Any, float]]:
+        """
+        :param query:       query text as sent to the site
+        :param before_id:   before_id as sent to the site, or None for the first page
+        :return:            tuple of (response body, seconds the request took), or None if the page wasn't recorded
+        """
+        return self._pages.get((query, before_id))
+
+    @property
+    def bytes_per_second(self) -> typing.Optional[float]:
+        """average download throughput while recording, or None if no downloads were recorded"""
+        size = sum(x[0] for x in self._files.values())
+        elapsed = sum(x[1] for x in self._files.values())
+        return size / elapsed if size and elapsed else None
+
+    def downloader(self, speed: float = 1.0, synthetic: bool = False) -> typing.Callable[[DownloadJob], DownloadResult]:
+        """
+        makes a download method for ArcturusCore which never touches the network
+
+        files which were recorded are replayed with their recorded size and duration.  any others use the post's size
+        and the average recorded throughput
+
+        :param speed:       1 replays at the recorded speed, 2 at twice that, etc.  0 doesn't throttle at all
+        :param synthetic:   if True, a file of zeros of the replayed size is written (as a part file, like a real
+                            download) for each download
+        :return:            picklable download method
+        """
+        return functools.partial(_replay_download, files=self._files, speed=speed,
+                                 bytes_per_second=self.bytes_per_second, synthetic=synthetic)
+
+
+def _replay_download(job: DownloadJob, files: typing.Mapping[str, typing.Tuple[int, float]], speed: float,
+                     bytes_per_second: typing.Optional[float], synthetic: bool) -> DownloadResult:
+    """
+    stands in for a real download
+
+    :param job:                 the file which would be downloaded
+    :param files:               recorded (size, seconds taken) of each file, keyed by url
+    :param speed:               1 for the recorded speed, 2 for twice that, etc.  0 to return as quickly as possible
+    :param bytes_per_second:    average recorded throughput, used for files which weren't recorded.  None if unknown
+    :param synthetic:           if True, write a file of zeros of the replayed size
+    :return:                    the result the real download would have had
+    """
+    start = time.monotonic()
+    destination = None
+
+    if job.url in files:
+        size, duration = files[job.url]
+    else:
+        size = job.size or 0
+        duration = size / bytes_per_second if bytes_per_second else 0.0
+
+    if synthetic:
+        zeros = memoryview(bytes(min(size, _SYNTHETIC_CHUNK)))
+        chunks = (zeros[:min(len(zeros), size - offset)] for offset in range(0, size, len(zeros) or 1))
+        write_part(job.destination, chunks, size)
+        destination = job.destination
+
+    if speed:
+        time.sleep(max(0.0, duration / speed - (time.monotonic() - start)))
+
+    return DownloadResult(job.url, destination, size, time.monotonic() - start)
@@ -0,0 +1,208 @@
+# coding=utf-8
+"""
+writing downloaded files to disk
+
+files are written to a '.part' file next to their destination, through a small write-behind buffer so the network and
+the disk are busy at the same time.  the worker which wrote a part file starts its writeback but doesn't wait for it.
+finished files are collected into a SyncGroup, which makes the whole group durable with one sync per filesystem, then
+renames each file to its destination and syncs each folder once.  a file at its destination is therefore always
+complete.
+"""
+
+import ctypes
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import typing
+from pathlib import Path
+
+PART_SUFFIX = '.part'
+
+_SYNC_FILE_RANGE_WRITE = 2
+
+
+def _libc_function(name: str, *argtypes):
+    # sync_file_range and syncfs are linux system calls which the os module doesn't wrap
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        function = getattr(ctypes.CDLL(None, use_errno=True), name)
+    except (OSError, AttributeError):
+        return None
+    function.argtypes = argtypes
+    return function
+
+
+_sync_file_range = _libc_function('sync_file_range', ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ctypes.c_uint)
+_syncfs = _libc_function('syncfs', ctypes.c_int)
+
+
+def part_path(destination: Path) -> Path:
+    """the path a file is written to before it is complete"""
+    return destination.with_name(destination.name + PART_SUFFIX)
+
+
+def _preallocate(fd: int, size: int):
+    # reserves the whole file up front so it isn't fragmented by many downloads growing side by side
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError:
+            pass  # not supported by every filesystem.  the file just grows as it is written instead
+
+
+def _start_writeback(fd: int):
+    # the kernel starts writing the file out now, while the rest of the group downloads, so the group's sync is quick
+    if _sync_file_range is not None:
+        _sync_file_range(fd, 0, 0, _SYNC_FILE_RANGE_WRITE)  # only a hint, so a failure doesn't matter
+
+
+def _sync_files(paths: typing.Iterable[Path]):
+    paths = list(paths)
+    if _syncfs is not None:
+        # one sync per filesystem covers every file in the group
+        devices = {}
+        for path in paths:
+            devices.setdefault(os.stat(path).st_dev, path)
+        for path in devices.values():
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                if _syncfs(fd) != 0:
+                    err = ctypes.get_errno()
+                    raise OSError(err, os.strerror(err), str(path))
+            finally:
+                os.close(fd)
+        return
+
+    for path in paths:
+        fd = os.open(path, os.O_RDWR)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def write_part(destination: Path, chunks: typing.Iterable[bytes], size: typing.Optional[int] = None,
+               buffer_chunks: int = 16) -> typing.Tuple[Path, int]:
+    """
+    writes chunks to the destination's part file.  the caller's thread reads chunks while another thread writes them.
+    the file isn't durable until its SyncGroup commits it.  if anything goes wrong, the part file is removed
+
+    :param destination:     final path of the file
+    :param chunks:          file contents (e.g. a response's iter_content)
+    :param size:            expected size in bytes, used to preallocate the file.  None if unknown
+    :param buffer_chunks:   the most chunks which may be waiting to be written.  reading pauses when the buffer is full
+    :return:                tuple of (part file path, bytes written)
+    """
+    path = part_path(destination)
+    buffer = queue.Queue(maxsize=buffer_chunks)
+    errors = []
+    written = 0
+
+    try:
+        with open(path, 'wb') as handle:
+            if size:
+                _preallocate(handle.fileno(), size)
+
+            def writer():
+                while True:
+                    chunk = buffer.get()
+                    if chunk is None:
+                        return
+                    if not errors:  # after a failure, keep draining so the reader can't block on a full buffer
+                        try:
+                            handle.write(chunk)
+                        except Exception as err:
+                            errors.append(err)
+
+            thread = threading.Thread(target=writer, daemon=True)
+            thread.start()
+            try:
+                for chunk in chunks:
+                    if errors:
+                        break
+                    if chunk:  # filter out keep-alive new chunks
+                        buffer.put(chunk)
+                        written += len(chunk)
+            finally:
+                buffer.put(None)
+                thread.join()
+
+            if errors:
+                raise errors[0]
+
+            # drop any preallocated space the file didn't need
+            handle.truncate(written)
+            handle.flush()
+            _start_writeback(handle.fileno())
+    except BaseException:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        raise
+
+    return path, written
+
+
+class SyncGroup:
+    """
+    makes finished part files durable and moves them to their destinations in groups
+
+    a group is committed when it has batch_size files, when its oldest file has waited max_delay seconds (checked as
+    files are added), or when commit is called.  committing syncs the group's files (once per filesystem where syncfs
+    is available, otherwise file by file), then renames every file, then syncs each folder involved once.
+    """
+
+    def __init__(self, batch_size: int = 64, max_delay: float = 5.0,
+                 on_commit: typing.Optional[typing.Callable[[typing.List[Path]], None]] = None):
+        """
+        :param batch_size:  most files in a group
+        :param max_delay:   longest a file may wait to be committed, in seconds
+        :param on_commit:   called with the destinations of each group once it has been committed
+        """
+        self._batch_size = batch_size
+        self._max_delay = max_delay
+        self._on_commit = on_commit
+        self._pending = {}  # destination -> None.  a dict keeps the order files were added and ignores duplicates
+        self._oldest = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, destination: Path):
+        """
+        :param destination: final path of a file whose part file has been completely written
+        """
+        if not self._pending:
+            self._oldest = time.monotonic()
+        self._pending[Path(destination)] = None
+
+        if len(self._pending) >= self._batch_size or time.monotonic() - self._oldest >= self._max_delay:
+            self.commit()
+
+    def commit(self):
+        """syncs every pending part file, renames each to its destination, then syncs the folders they are in"""
+        if not self._pending:
+            return
+
+        _sync_files(part_path(x) for x in self._pending)
+        for destination in self._pending:
+            os.replace(part_path(destination), destination)
+
+        # the renames themselves are only durable once their folders are synced
+        if os.name == 'posix':
+            for directory in {x.parent for x in self._pending}:
+                fd = os.open(directory, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+
+        logging.getLogger().debug("committed %d files", len(self._pending))
+        committed, self._pending = list(self._pending), {}
+        if self._on_commit is not None:
+            self._on_commit(committed)
@@ -0,0 +1,42 @@
+# coding=utf-8
+"""reading and writing of download manifests, which are jsonl files containing one post per line"""
+
+import io
+import json
+import typing
+
+from .Post import Post
+
+
+class Manifest:
+    """
+    a manifest records everything a run intends to download, so listing ("plan") and downloading ("execute") can
+    happen at different times or on different machines
+    """
+
+    @staticmethod
+    def write(posts: typing.Iterable[Post], fp: io.TextIOBase) -> int:
+        """
+        streams posts to fp as they arrive, one json object per line
+        :param posts:   posts to write (consumed lazily, so this can be a live generator)
+        :param fp:      text file opened for writing or appending
+        :return:        number of posts written
+        """
+        count = 0
+        for post in posts:
+            fp.write(json.dumps(post.to_dict(), separators=(',', ':')) + '\n')
+            count += 1
+        fp.flush()
+        return count
+
+    @staticmethod
+    def read(fp: typing.Iterable[str]) -> typing.Generator[Post, None, None]:
+        """
+        lazily reads posts back from a manifest.  blank lines are skipped
+        :param fp:  text file opened for reading (or any iterable of lines)
+        :return:    generator of posts in the order they were written
+        """
+        for line in fp:
+            line = line.strip()
+            if line:
+                yield Post.from_dict(json.loads(line))
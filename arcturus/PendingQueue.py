@@ -0,0 +1,158 @@
+# coding=utf-8
+"""crash-safe, on-disk queue of posts waiting to be downloaded"""
+
+import json
+import os
+import threading
+import typing
+from pathlib import Path
+
+from .Manifest import Manifest
+from .Post import Post
+
+_QUEUE_NAME = 'queue.jsonl'
+_CHECKPOINT_NAME = 'checkpoint.json'
+
+
+class PendingQueue:
+    """
+    spills pending posts to an append-only manifest so memory use doesn't grow with the size of the backlog
+
+    a checkpoint records how far each listing has got, how many bytes of the byte budget the queued posts were charged,
+    how much of the queue file is complete and how much of it has been downloaded.  anything written after the last
+    checkpoint is discarded when the queue is reopened, so a restarted run carries on exactly where the last checkpoint
+    left it.
+
+    one thread may append listings while another reads batches: batches only reads what has been checkpointed, and
+    waits for more until end_listing is called.
+    """
+
+    def __init__(self, directory: typing.Union[str, Path]):
+        self._directory = Path(directory)
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._queue_path = self._directory / _QUEUE_NAME
+        self._checkpoint_path = self._directory / _CHECKPOINT_NAME
+
+        self._state = {"listings": {}, "charged": 0, "queued": 0, "consumed": 0}
+        if self._checkpoint_path.exists():
+            with open(self._checkpoint_path) as fp:
+                self._state = json.load(fp)
+
+        # anything after the last checkpoint may be a partial write, so drop it
+        self._queue = open(self._queue_path, 'a', encoding='utf-8', newline='\n')
+        self._queue.truncate(self._state["queued"])
+
+        # guards the state and the queue file, and wakes batches when something has been checkpointed
+        self._changed = threading.Condition(threading.RLock())
+        self._listing_ended = False
+
+    @property
+    def resumed(self) -> bool:
+        """True if the queue was reopened from an earlier, unfinished run"""
+        return bool(self._state["listings"])
+
+    @property
+    def charged(self) -> int:
+        """bytes of the byte budget charged for the queued posts, as of the last checkpoint"""
+        return self._state.get("charged", 0)
+
+    def progress(self, key: str) -> typing.Tuple[typing.Any, bool]:
+        """
+        :param key: identifies a listing
+        :return:    tuple of (cursor of the last page checkpointed or None, whether the listing is finished)
+        """
+        with self._changed:
+            listing = self._state["listings"].get(key, {})
+            return listing.get("cursor"), listing.get("done", False)
+
+    def append(self, posts: typing.Iterable[Post], key: str, cursor: typing.Any, done: bool = False,
+               charged: typing.Optional[int] = None) -> int:
+        """
+        queues posts from one page of a listing, then checkpoints the listing's progress
+        :param posts:   posts to queue
+        :param key:     identifies the listing the page came from
+        :param cursor:  the source's cursor for the page (see Source.get_pages).  must be json-serializable
+        :param done:    True if this was the last page of the listing
+        :param charged: total bytes of the byte budget charged so far, including these posts.  None to leave it as is
+        :return:        number of posts queued
+        """
+        with self._changed:
+            count = Manifest.write(posts, self._queue)
+            self._state["listings"][key] = {"cursor": cursor, "done": done}
+            if charged is not None:
+                self._state["charged"] = charged
+            self.checkpoint()
+            return count
+
+    def finish(self, key: str):
+        """marks a listing as finished"""
+        cursor, _ = self.progress(key)
+        self.append([], key, cursor, done=True)
+
+    def end_listing(self):
+        """tells batches that nothing more will be appended in this run, so it returns once the queue is drained"""
+        with self._changed:
+            self._listing_ended = True
+            self._changed.notify_all()
+
+    def batches(self, size: int) -> typing.Generator[typing.List[Post], None, None]:
+        """
+        reads the queue back in batches, starting after the last batch known to be downloaded
+
+        batches are read while listing continues: when fewer than size posts are waiting, this waits for more to be
+        checkpointed, until end_listing is called.  a batch is only checkpointed as downloaded when the next one is
+        requested, so stop iterating (or crash) part way through a batch and the whole batch is returned again next time
+
+        :param size:    the most posts in a batch
+        :return:        generator of lists of posts
+        """
+        with open(self._queue_path, 'rb') as fp:
+            fp.seek(self._state["consumed"])
+            lines = []
+            while True:
+                with self._changed:
+                    self._changed.wait_for(lambda: self._listing_ended or fp.tell() < self._state["queued"])
+                    end, ended = self._state["queued"], self._listing_ended
+
+                # only checkpointed lines are read, so a page which is still being written is never seen
+                while len(lines) < size and fp.tell() < end:
+                    lines.append(fp.readline().decode('utf-8'))
+
+                drained = ended and fp.tell() >= end
+                if not lines and drained:
+                    return
+                if len(lines) < size and not drained:
+                    continue
+
+                yield list(Manifest.read(lines))
+                lines = []
+
+                with self._changed:
+                    self._state["consumed"] = fp.tell()
+                    self.checkpoint()
+
+    def checkpoint(self):
+        """makes the queue file durable, then atomically replaces the checkpoint"""
+        with self._changed:
+            self._queue.flush()
+            os.fsync(self._queue.fileno())
+            self._state["queued"] = os.fstat(self._queue.fileno()).st_size
+
+            temp_path = self._checkpoint_path.with_suffix('.tmp')
+            with open(temp_path, 'w') as fp:
+                json.dump(self._state, fp)
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.replace(temp_path, self._checkpoint_path)
+            self._changed.notify_all()
+
+    def close(self):
+        self._queue.close()
+
+    def clear(self):
+        """removes the queue and its checkpoint.  called once every queued post has been downloaded"""
+        self.close()
+        for path in (self._queue_path, self._checkpoint_path):
+            if path.exists():
+                path.unlink()
+        self._directory.rmdir()
@@ -1,13 +1,37 @@
 # coding=utf-8
 
+import os.path
 import typing
+from collections import namedtuple
+
+# renditions of a post's file which a source may offer, largest first
+ORIGINAL = 'original'
+SAMPLE = 'sample'
+PREVIEW = 'preview'
+VARIANTS = (ORIGINAL, SAMPLE, PREVIEW)
+
+# size is in bytes.  any field may be None if the source doesn't report it
+Variant = namedtuple('Variant', ['url', 'size', 'width', 'height'])
 
 class Post:
-    def __init__(self, url: str, tags: typing.Optional[typing.Iterable[str]], md5: str, filename: str, ext: str):
+    def __init__(self, url: str, tags: typing.Optional[typing.Iterable[str]], md5: str, filename: str, ext: str,
+                 query: typing.Optional[str] = None, alias: typing.Optional[str] = None,
+                 created_at: typing.Optional[int] = None, rating: typing.Optional[str] = None,
+                 score: typing.Optional[int] = None, file_size: typing.Optional[int] = None,
+                 variants: typing.Optional[typing.Mapping[str, Variant]] = None, variant: str = ORIGINAL):
         self._url = url
         self._tags = tags
         self._md5 = md5
+        self._filename = filename
         self._ext = ext
+        self._query = query
+        self._alias = alias
+        self._created_at = created_at
+        self._rating = rating
+        self._score = score
+        self._file_size = file_size
+        self._variants = {name: Variant(*x) for name, x in (variants or {}).items()}
+        self._variant = variant
 
     @property
     def url(self):
@@ -21,6 +45,103 @@ class Post:
     def md5(self):
         return self._md5
 
+    @property
+    def filename(self):
+        return self._filename
+
     @property
     def ext(self):
         return self._ext
+
+    @property
+    def query(self):
+        """the taglist query that found this post"""
+        return self._query
+
+    @property
+    def alias(self):
+        """the alias of the taglist query that found this post, if it had one"""
+        return self._alias
+
+    @property
+    def created_at(self):
+        """upload time as a unix timestamp, if the source provides it"""
+        return self._created_at
+
+    @property
+    def rating(self):
+        """content rating ('s', 'q' or 'e'), if the source provides it"""
+        return self._rating
+
+    @property
+    def score(self):
+        return self._score
+
+    @property
+    def file_size(self):
+        """size of the file at url in bytes, if the source provides it"""
+        return self._file_size
+
+    @property
+    def variants(self) -> typing.Dict[str, Variant]:
+        """every rendition of the file the source offers, keyed by ORIGINAL, SAMPLE or PREVIEW"""
+        return self._variants
+
+    @property
+    def variant(self) -> str:
+        """which of the variants url refers to"""
+        return self._variant
+
+    def with_variant(self, name: str) -> 'Post':
+        """
+        copies the post, switching url, filename, ext and file_size to another of its variants
+        :param name:    ORIGINAL, SAMPLE or PREVIEW
+        :return:        new post
+        """
+        chosen = self.variants[name]
+        filename = os.path.basename(chosen.url)
+        fields = self.to_dict()
+        fields.update(url=chosen.url, filename=filename, ext=os.path.splitext(filename)[1].lstrip('.'),
+                      file_size=chosen.size, variant=name)
+        return self.from_dict(fields)
+
+    def to_dict(self) -> dict:
+        """
+        converts the post to a json-serializable dict (the inverse of from_dict)
+        :return: dict with one key per public property
+        """
+        return {
+            "url": self.url,
+            "tags": list(self.tags) if self.tags is not None else None,
+            "md5": self.md5,
+            "filename": self.filename,
+            "ext": self.ext,
+            "query": self.query,
+            "alias": self.alias,
+            "created_at": self.created_at,
+            "rating": self.rating,
+            "score": self.score,
+            "file_size": self.file_size,
+            "variants": {name: list(x) for name, x in self.variants.items()},
+            "variant": self.variant,
+        }
+
+    def for_query(self, query: typing.Optional[str], alias: typing.Optional[str]) -> 'Post':
+        """
+        copies the post, attributing the copy to a different taglist query
+        :param query:   the taglist query that found this post
+        :param alias:   the alias of that query
+        :return:        new post
+        """
+        fields = self.to_dict()
+        fields.update(query=query, alias=alias)
+        return self.from_dict(fields)
+
+    @classmethod
+    def from_dict(cls, fields: dict) -> 'Post':
+        """
+        creates a post from a dict created by to_dict
+        :param fields: dict with one key per public property
+        :return: new post
+        """
+        return cls(**fields)
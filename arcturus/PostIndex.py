@@ -0,0 +1,185 @@
+# coding=utf-8
+"""local sqlite index of the metadata of every post a source has listed"""
+
+import datetime
+import fnmatch
+import json
+import sqlite3
+import typing
+from pathlib import Path
+
+from .Blacklist import Predicate, compile_meta
+from .Post import Post
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    md5         TEXT PRIMARY KEY,
+    created_at  INTEGER,
+    data        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS posts_created_at ON posts (created_at);
+CREATE TABLE IF NOT EXISTS tags (
+    tag         TEXT NOT NULL,
+    md5         TEXT NOT NULL,
+    PRIMARY KEY (tag, md5)
+) WITHOUT ROWID;
+"""
+
+_NEG_PREFIX = '-'
+_OR_PREFIX = '~'
+_META_CHAR = ':'
+_WILDCARD_CHAR = '*'
+
+
+class PostIndex:
+    """
+    stores post metadata as it is listed so that queries and blacklists can be re-evaluated without the network
+
+    a post is stored once per md5 no matter how many queries found it.  the query and alias are not stored because they
+    belong to a single run rather than the post itself.
+    """
+
+    def __init__(self, path: typing.Union[str, Path], batch_size: int = 1000):
+        """
+        :param path:        sqlite database file (created if needed).  ':memory:' gives a throwaway index
+        :param batch_size:  number of added posts to buffer in a transaction before committing
+        """
+        # listing can happen on a pool's feeder thread, but only ever one thread at a time
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._batch_size = batch_size
+        self._uncommitted = 0
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+
+    def __contains__(self, md5: str) -> bool:
+        return self._db.execute("SELECT 1 FROM posts WHERE md5 = ?", (md5,)).fetchone() is not None
+
+    def add(self, post: Post):
+        """
+        adds or replaces the metadata of a post.  changes are committed every batch_size posts and by flush
+        :param post: post to store
+        """
+        stored = post.for_query(None, None)
+        self._db.execute("INSERT OR REPLACE INTO posts (md5, created_at, data) VALUES (?, ?, ?)",
+                         (stored.md5, stored.created_at, json.dumps(stored.to_dict(), separators=(',', ':'))))
+        self._db.execute("DELETE FROM tags WHERE md5 = ?", (stored.md5,))
+        self._db.executemany("INSERT OR IGNORE INTO tags (tag, md5) VALUES (?, ?)",
+                             ((tag, stored.md5) for tag in stored.tags or []))
+
+        self._uncommitted += 1
+        if self._uncommitted >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        """commits any posts added since the last commit"""
+        self._db.commit()
+        self._uncommitted = 0
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+    def query(self, query: str, lastrun: typing.Optional[datetime.datetime] = None) -> typing.Generator[Post, None, None]:
+        """
+        finds stored posts matching a taglist query, newest first
+
+        plain tags must all be present, '-' tags must all be absent, and at least one '~' tag must be present when any
+        are given.  '*' wildcards are supported.  the meta terms the blacklist understands (rating, score, filesize,
+        type) are checked against each post's stored metadata.  other meta terms can't be answered from the index, so
+        the query is rejected rather than answered with more posts than the site would list.
+
+        :param query:   query text, as found in the taglist
+        :param lastrun: if given, only posts created after this are returned
+        :return:        generator of matching posts
+        :raises ValueError: if the query has a meta term the index can't evaluate
+        """
+        clauses = []
+        params = []
+        or_terms = []
+        meta, neg_meta, or_meta = [], [], []
+
+        for term in query.lower().split():
+            if _META_CHAR in term.lstrip(_OR_PREFIX + _NEG_PREFIX):
+                predicate = self._compile_meta(term)
+                if predicate is not None:
+                    if term.startswith(_OR_PREFIX):
+                        or_meta.append(predicate)
+                    elif term.startswith(_NEG_PREFIX):
+                        neg_meta.append(predicate)
+                    else:
+                        meta.append(predicate)
+                    continue
+
+            if term.startswith(_OR_PREFIX):
+                or_terms.append(term[1:])
+                continue
+
+            if term.startswith(_NEG_PREFIX):
+                clauses.append(f"md5 NOT IN ({self._tag_subquery(term[1:])})")
+                params.append(term[1:])
+            else:
+                clauses.append(f"md5 IN ({self._tag_subquery(term)})")
+                params.append(term)
+
+        # with meta OR terms, a post may match through its metadata instead of an OR tag, so OR tags are checked
+        # alongside them below rather than in the sql
+        tag_or_terms = or_terms if not or_meta else []
+        if tag_or_terms:
+            clauses.append("(" + " OR ".join(f"md5 IN ({self._tag_subquery(x)})" for x in tag_or_terms) + ")")
+            params.extend(tag_or_terms)
+
+        if lastrun is not None:
+            clauses.append("created_at > ?")
+            params.append(int(lastrun.timestamp()))
+
+        sql = "SELECT data FROM posts"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        # md5 breaks ties, so the order is the same every time and a listing resumed part way through is consistent
+        sql += " ORDER BY created_at DESC, md5"
+
+        # terms are all checked before this returns, so a bad query fails here rather than when it is first iterated
+        return self._matching(sql, params, meta, neg_meta, or_meta, or_terms)
+
+    def _matching(self, sql: str, params: list, meta: list, neg_meta: list, or_meta: list,
+                  or_terms: list) -> typing.Generator[Post, None, None]:
+        for (data,) in self._db.execute(sql, params):
+            post = Post.from_dict(json.loads(data))
+            if meta or neg_meta or or_meta:
+                metadata = post.to_dict()
+                if not all(x(metadata) is True for x in meta) or not all(x(metadata) is False for x in neg_meta):
+                    continue
+                if or_meta and not (any(x(metadata) is True for x in or_meta) or
+                                    any(self._has_tag(post, x) for x in or_terms)):
+                    continue
+            yield post
+
+    @staticmethod
+    def _compile_meta(term: str) -> typing.Optional[Predicate]:
+        """
+        :param term:    meta term, possibly with a '~' or '-' prefix
+        :return:        the blacklist's predicate for the term, or None if the term is really a tag containing ':'
+        :raises ValueError: if the term is a meta term the index can't evaluate
+        """
+        bare = term.lstrip(_OR_PREFIX).lstrip(_NEG_PREFIX)
+        predicate = compile_meta(bare)
+        name = bare.split(_META_CHAR, maxsplit=1)[0]
+        if predicate is None and name.isalpha():
+            raise ValueError(f"meta term '{term}' can't be searched in the local index")
+        return predicate
+
+    @staticmethod
+    def _has_tag(post: Post, term: str) -> bool:
+        if _WILDCARD_CHAR in term:
+            return any(fnmatch.fnmatchcase(tag, term) for tag in post.tags)
+        return term in post.tags
+
+    @staticmethod
+    def _tag_subquery(term: str) -> str:
+        if _WILDCARD_CHAR in term:
+            return "SELECT md5 FROM tags WHERE tag GLOB ?"
+        return "SELECT md5 FROM tags WHERE tag = ?"
@@ -0,0 +1,96 @@
+# coding=utf-8
+"""choosing which rendition of a post to download, and keeping a run within a total byte budget"""
+
+import logging
+import typing
+
+from .Post import Post, VARIANTS
+
+
+class SizePolicy:
+    """
+    picks the largest variant of each post which fits within a size cap, and charges it against the run's byte budget
+
+    caps can be set for all queries and overridden for single queries (by alias or query text).  variants whose size
+    the source doesn't report are assumed to fit a cap, since there's no way to tell without downloading them.  they
+    are charged to the budget as if they were as large as the post's largest known variant, and refused if the post
+    has no known sizes at all, so that the budget can't be overrun.
+    """
+
+    def __init__(self,
+                 max_file_size: typing.Optional[int] = None,
+                 query_max_file_size: typing.Optional[typing.Mapping[str, int]] = None,
+                 byte_budget: typing.Optional[int] = None):
+        """
+        :param max_file_size:       largest file to download for any query, in bytes.  None or 0 for no limit
+        :param query_max_file_size: caps for single queries, keyed by alias or query text.  overrides max_file_size
+        :param byte_budget:         total bytes to download in this run.  None or 0 for no limit
+        """
+        self._max_file_size = max_file_size or None
+        self._query_max_file_size = query_max_file_size or {}
+        self._budget = byte_budget or None
+        self._spent = 0
+
+    @property
+    def remaining(self) -> typing.Optional[int]:
+        """bytes left in the budget, or None if there is no budget"""
+        return None if self._budget is None else self._budget - self._spent
+
+    @property
+    def spent(self) -> int:
+        """bytes charged so far"""
+        return self._spent
+
+    def charge(self, size: int):
+        """
+        charges bytes to the budget, e.g. those already selected by an earlier, interrupted run
+        :param size:    bytes to charge
+        """
+        self._spent += size
+
+    def _cap(self, post: Post) -> typing.Optional[int]:
+        for key in (post.alias, post.query):
+            if key in self._query_max_file_size:
+                return self._query_max_file_size[key] or None
+        return self._max_file_size
+
+    @staticmethod
+    def _options(post: Post) -> typing.List[typing.Tuple[str, typing.Optional[int]]]:
+        # sources which don't list variants only have the file at url
+        if not post.variants:
+            return [(post.variant, post.file_size)]
+        return [(name, post.variants[name].size) for name in VARIANTS if name in post.variants]
+
+    def select(self, post: Post) -> typing.Optional[Post]:
+        """
+        chooses a variant for the post and charges its size to the budget
+        :param post:    post as listed by a source
+        :return:        the post switched to the chosen variant, or None if no variant fits the cap and budget
+        """
+        cap = self._cap(post)
+        remaining = self.remaining
+        if cap is None and remaining is None:
+            return post
+
+        if remaining is not None and remaining <= 0:
+            logging.getLogger().debug("%s: the byte budget is used up", post.md5)
+            return None
+
+        options = self._options(post)
+        known = [size for _, size in options if size is not None]
+        estimate = max(known) if known else None
+
+        for name, size in options:
+            if cap is not None and size is not None and size > cap:
+                continue
+
+            cost = size if size is not None else estimate
+            if remaining is not None:
+                if cost is None or cost > remaining:
+                    continue
+                self.charge(cost)
+
+            return post if name == post.variant else post.with_variant(name)
+
+        logging.getLogger().debug("%s: no variant fits within cap %s, budget %s", post.md5, cap, remaining)
+        return None
@@ -1,13 +1,19 @@
 # coding=utf-8
 
+import typing
 from collections import namedtuple
 
 _IGNORE_LASTRUN_CHAR = '|'
 _ALIAS = '~'
 _COMMENT_CHAR = '#'
+_OR_PREFIX = '~'
+_UNCOALESCABLE_CHARS = ('-', '~', ':', '*')
 
 Query = namedtuple('Query', ['text', 'alias', 'ignore_lastrun'])
 
+# a single listing request which answers one or more queries.  members holds the queries it answers
+CoalescedQuery = namedtuple('CoalescedQuery', ['text', 'members', 'ignore_lastrun'])
+
 class Taglist:
     @staticmethod
     def factory(fp):
@@ -18,6 +24,49 @@ class Taglist:
                 queries.append(query)
         return queries
 
+    @staticmethod
+    def coalesce(queries: typing.Iterable[Query], max_tags: int) -> typing.List[CoalescedQuery]:
+        """
+        merges single-tag queries into OR-style listing requests ("~a ~b ~c") of at most max_tags tags each
+
+        only queries consisting of one plain tag can be merged, and only with queries sharing the same ignore_lastrun
+        setting.  every other query becomes a CoalescedQuery of its own.  the results of a merged request must be split
+        back to the member queries by checking which member tags each post carries
+
+        :param queries:     queries as returned by factory
+        :param max_tags:    the most tags the site allows in a single listing request
+        :return:            listing requests which together answer every query
+        """
+        coalesced = []
+        open_groups = {}
+
+        def close(ignore_lastrun):
+            members = tuple(open_groups.pop(ignore_lastrun))
+            if len(members) == 1:
+                text = members[0].text
+            else:
+                text = ' '.join(_OR_PREFIX + x.text for x in members)
+            coalesced.append(CoalescedQuery(text, members, ignore_lastrun))
+
+        for query in queries:
+            if max_tags < 2 or not Taglist._is_coalescable(query):
+                coalesced.append(CoalescedQuery(query.text, (query,), query.ignore_lastrun))
+                continue
+
+            open_groups.setdefault(query.ignore_lastrun, []).append(query)
+            if len(open_groups[query.ignore_lastrun]) >= max_tags:
+                close(query.ignore_lastrun)
+
+        for ignore_lastrun in list(open_groups):
+            close(ignore_lastrun)
+
+        return coalesced
+
+    @staticmethod
+    def _is_coalescable(query: Query) -> bool:
+        terms = query.text.split()
+        return len(terms) == 1 and not any(x in terms[0] for x in _UNCOALESCABLE_CHARS)
+
     @staticmethod
     def _parse_taglist_line(raw_text: str) -> Query:
 
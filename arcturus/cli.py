@@ -2,17 +2,21 @@
 """top level of project code"""
 
 import argparse
+import copy
 import ctypes
 import logging
 import logging.handlers
+import multiprocessing
 import os
 import pathlib
 import json
+import tempfile
+import threading
+import time
 
 from pathlib import Path
 from shutil import copyfile
 from typing import Optional
-from datetime import datetime
 from jsonschema.exceptions import ValidationError
 from json.decoder import JSONDecodeError
 
@@ -21,12 +25,18 @@ from .Blacklist import Blacklist
 from .version import VERSION
 from .config import get_config
 from .Taglist import Taglist
+from .PostIndex import PostIndex
+from .Cache import Cache
+from .SizePolicy import SizePolicy
+from .Cassette import Cassette, CassetteRecorder
 
 CONFIG_JSON_NAME = 'config.json'
 CONFIG_SCHEMA_NAME = 'arcturus/resources/config_schema.json'
 CONFIG_DEFAULT_NAME = 'arcturus/resources/config_default.json'
 DEFAULT_TAGLIST_NAME = 'taglist.txt'
 DEFAULT_CACHE_NAME = '.cache'
+DEFAULT_INDEX_NAME = '.index'
+DEFAULT_PENDING_NAME = '.pending'
 
 
 def get_cli_args(program: str, version: str) -> argparse.Namespace:
@@ -43,20 +53,115 @@ def get_cli_args(program: str, version: str) -> argparse.Namespace:
                         help=f"specify custom config file (default={CONFIG_JSON_NAME})")
     parser.add_argument('--debug', action="store_true", default=False,
                         help="log debug output to terminal")
+    traffic = parser.add_mutually_exclusive_group()
+    traffic.add_argument('--offline', action="store_true", default=False,
+                         help="answer queries from the local post index instead of the site.  no listing requests are made, "
+                              "but files are still downloaded")
+    traffic.add_argument('--record', metavar='CASSETTE',
+                         help="record listing pages and download sizes/timings to a cassette file")
+    traffic.add_argument('--replay', metavar='CASSETTE',
+                         help="replay a recorded cassette instead of using the site (no network is used)")
+    parser.add_argument('--replay-speed', type=float, default=1.0,
+                        help="with --replay: 1 replays in real time, 2 twice as fast, 0 unthrottled (default=1)")
+    parser.add_argument('--synthetic', action="store_true", default=False,
+                        help="with --replay: write files of zeros with the recorded sizes instead of no files at all")
+    parser.add_argument('--replay-dir',
+                        help="with --replay: folder for the replay's downloads and pending queue, so the real ones are "
+                             "never touched (default=a new temporary folder)")
+
+    # with no command, posts are listed and downloaded in a single pass
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    plan = commands.add_parser('plan', help="list and filter posts, writing them to a manifest instead of downloading")
+    plan.add_argument('manifest', help="path of the jsonl manifest to write")
+    execute = commands.add_parser('execute', help="download the posts in one or more manifests written by 'plan'")
+    execute.add_argument('manifests', nargs='+', help="paths of the jsonl manifests to download")
+    rebuild = commands.add_parser('rebuild-cache', help="hash the files already in the download dir into the cache")
+    rebuild.add_argument('--processes', type=int, default=os.cpu_count(),
+                         help="number of hashing processes (default=number of cpus)")
     return parser.parse_args()
 
-class LoggingCodeLocation(logging.Filter):
-    def filter(self, record):
+class LoggingCodeLocation(logging.Formatter):
+    """
+    formatter which adds %(code_location)s to records.  this is done when the record is formatted, on the logging thread,
+    rather than by a filter on every logging call
+    """
+    def format(self, record):
         record.code_location = "[%s:%s:%d]" % (os.path.splitext(record.filename)[0], record.funcName, record.lineno)
-        return True
+        return super().format(record)
+
+class LoggingRateLimit(logging.Filter):
+    """
+    limits how often each line of code may log at debug level, so per-post and per-page messages can't flood the log
+
+    at most `burst` records from a single call site are let through in each `interval` seconds.  the first record let
+    through after some were dropped says how many were dropped.  records above debug level are never dropped.
+    """
+    def __init__(self, burst: int = 20, interval: float = 1.0):
+        super().__init__()
+        self._burst = burst
+        self._interval = interval
+        self._windows = {}  # (pathname, lineno) -> [window start, records let through, records dropped]
+        self._lock = threading.Lock()  # records are filtered on whichever thread logged them
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+
+            if window is None or now - window[0] >= self._interval:
+                if window is not None and window[2]:
+                    record.msg = f"{record.msg} ({window[2]} similar messages dropped)"
+                self._windows[key] = [now, 1, 0]
+                return True
+
+            if window[1] < self._burst:
+                window[1] += 1
+                return True
+
+            window[2] += 1
+            return False
+
+class LoggingQueueHandler(logging.handlers.QueueHandler):
+    """
+    queue handler which leaves formatting to the listener.  the stock handler formats every message on the calling
+    thread before queueing it
+
+    the queue may lead to another process (pool workers log to the main process's queue), so records must be picklable.
+    messages whose arguments aren't plain values, and tracebacks, are still rendered here
+    """
+    _PLAIN = (str, int, float, bool, type(None))
+
+    def prepare(self, record):
+        record = copy.copy(record)
+
+        if not isinstance(record.msg, str) or not (isinstance(record.args, tuple) and
+                                                   all(isinstance(x, self._PLAIN) for x in record.args)):
+            record.msg, record.args = record.getMessage(), None
+
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+_log_listener = None
 
 def setup_logging(debug_output: bool = False, backup_count: int = 10, currentfile = __file__):
     """
     sets up logging so messages with error and higher go to console but everything is logged to file
 
+    logging calls only put the record on a queue.  formatting and writing happen on a background thread, which is
+    stopped (and the queue drained) by teardown().  the queue is a multiprocessing queue, so that pool worker processes,
+    which inherit the root logger's handler, log through the same thread rather than into a queue nobody reads
+
     :param debug_output: if true, log debug output to terminal as well as file
     :return: None
     """
+    global _log_listener
 
     verbose_fmt = '[%(asctime)s.%(msecs)03d] %(levelname)-8s %(code_location)-25s %(message)s'
     simple_fmt = '[%(asctime)s] %(levelname)-8s %(message)s'
@@ -71,25 +176,19 @@ def setup_logging(debug_output: bool = False, backup_count: int = 10, currentfil
     # the log file will use all settings applied to the root_logger
     # the log file always logs everything and uses a more verbose format
     root_logger = logging.getLogger()
-    root_logger.addFilter(LoggingCodeLocation())
     root_logger.setLevel(logging.DEBUG)
 
-    root_formatter = logging.Formatter(fmt=verbose_fmt, datefmt=verbose_datefmt)
+    root_formatter = LoggingCodeLocation(fmt=verbose_fmt, datefmt=verbose_datefmt)
 
     # define a console handler which has a simpler format (when debug_output=False)
     console = logging.StreamHandler()
     if debug_output:
         console.setLevel(logging.DEBUG)
-        console.setFormatter(logging.Formatter(fmt=verbose_fmt, datefmt=simple_datefmt))
+        console.setFormatter(LoggingCodeLocation(fmt=verbose_fmt, datefmt=simple_datefmt))
     else:
         console.setLevel(logging.WARNING)
         console.setFormatter(logging.Formatter(fmt=simple_fmt, datefmt=simple_datefmt))
 
-    root_logger.addHandler(console)
-
-    # create the log/ directory if needed
-    pathlib.Path('log').mkdir(parents=True, exist_ok=True)
-
     # define a rotating file handler that logs everything to file (debug)
     rotating_file = logging.handlers.RotatingFileHandler(
         log_path,
@@ -98,12 +197,20 @@ def setup_logging(debug_output: bool = False, backup_count: int = 10, currentfil
         delay=True)
 
     rotating_file.setFormatter(root_formatter)
-    root_logger.addHandler(rotating_file)
 
     # if log already exist force a roller so that every run has it's own log
     if os.path.isfile(log_path):
         rotating_file.doRollover()
 
+    # the root logger only gets the queue.  the console and file are written by the listener's thread
+    log_queue = multiprocessing.Queue(-1)
+    queue_handler = LoggingQueueHandler(log_queue)
+    queue_handler.addFilter(LoggingRateLimit())
+    root_logger.addHandler(queue_handler)
+
+    _log_listener = logging.handlers.QueueListener(log_queue, console, rotating_file, respect_handler_level=True)
+    _log_listener.start()
+
 def mk_file(path: Path, file_desc: str, contents: Optional[str] = None):
     """
     creates a file at path with the supplied contents
@@ -222,39 +329,101 @@ def startup() -> {bool, argparse.Namespace, dict}:
 def run(args, config):
     log = logging.getLogger()
 
+    if args.command == 'rebuild-cache':
+        cache = Cache.load(DEFAULT_CACHE_NAME)
+        hashed = cache.rebuild(Path(config["download_dir"]), args.processes)
+        cache.save(DEFAULT_CACHE_NAME)
+        log.info(f"hashed {hashed} files, cache now contains {len(cache)} entries")
+        return
+
     taglist = Taglist.factory(open(config["taglist_file"]))
 
     blacklist = None
-    if config.get("blacklist_ignored", False):
+    if not config.get("blacklist_ignored", False):
         with open(config["blacklist_file"]) as fp:
             blacklist = Blacklist([x.strip() for x in fp.readlines()])
 
     cache = None
     if not config.get("cache_ignored", False):
-        with open(DEFAULT_CACHE_NAME) as fp:
-            contents = json.load(fp)
-            cache = set(contents["cache"])
+        cache = Cache.load(DEFAULT_CACHE_NAME)
 
     lastrun = None
-    if config.get("lastrun_ignored", False):
-        lastrun = datetime.date(datetime.strptime(config["lastrun"], '%Y-%m-%d'))
-
-    site_source = config["site"].source()
+    if not config.get("lastrun_ignored", False):
+        lastrun = config["lastrun"]
+
+    # replayed traffic isn't real, so it is kept out of the index
+    index = None
+    if args.offline or not (args.replay or config.get("index_ignored", False)):
+        index = PostIndex(DEFAULT_INDEX_NAME)
+
+    recorder = None
+    download_kwargs = {}
+    download_dir = Path(config["download_dir"])
+    pending_dir = Path(DEFAULT_PENDING_NAME)
+    if args.offline:
+        site_source = ArcturusCore.import_arcturus_source('index').source(index=index)
+    elif args.replay:
+        with open(args.replay) as fp:
+            cassette = Cassette.load(fp)
+        site_source = ArcturusCore.import_arcturus_source('replay').source(cassette=cassette, speed=args.replay_speed)
+        download_kwargs['download_method'] = cassette.downloader(speed=args.replay_speed, synthetic=args.synthetic)
+
+        # a replay mustn't resume (or clear) the real pending queue, or put synthetic files among real downloads
+        replay_dir = Path(args.replay_dir or tempfile.mkdtemp(prefix='arcturus-replay-'))
+        download_dir = replay_dir / 'downloads'
+        pending_dir = replay_dir / DEFAULT_PENDING_NAME
+        download_dir.mkdir(parents=True, exist_ok=True)
+        log.info(f"replaying into {replay_dir}")
+    else:
+        if args.record:
+            recorder = CassetteRecorder(open(args.record, 'w'))
+        site_source = config["site"].source(index=index, recorder=recorder)
 
     core = ArcturusCore(
         source=site_source,
         taglist=taglist,
-        download_dir=config["download_dir"],
+        download_dir=download_dir,
         lastrun=lastrun,
         blacklist=blacklist,
-        cache=cache
+        cache=cache,
+        download_threads=config["download_threads"],
+        download_nameformat=config["download_nameformat"],
+        query_coalescing=config["query_coalescing"],
+        pending_dir=pending_dir,
+        size_policy=SizePolicy(max_file_size=config["download_max_filesize"],
+                               query_max_file_size=config["download_max_filesize_per_query"],
+                               byte_budget=config["download_byte_budget"]),
+        recorder=recorder
     )
     log.debug(f"core created")
-    core.update(namefmt=config["download_nameformat"])
+
+    if args.command == 'plan':
+        with open(args.manifest, 'w') as manifest:
+            count = core.plan(manifest)
+        log.info(f"planned {count} downloads to {args.manifest}")
+    elif args.command == 'execute':
+        count = core.execute([Path(x) for x in args.manifests], **download_kwargs)
+        log.info(f"downloaded {count} files from {len(args.manifests)} manifest(s)")
+    else:
+        count = core.update(**download_kwargs)
+        log.info(f"downloaded {count} files")
+
+    # replayed downloads aren't real, so they are kept out of the cache
+    if cache is not None and not args.replay:
+        cache.save(DEFAULT_CACHE_NAME)
+    if index is not None:
+        index.close()
+    if recorder is not None:
+        recorder.close()
 
 
 def teardown():
     log = logging.getLogger()
+    log.debug(">>> arcturus has finished")
+
+    # write out anything still queued
+    if _log_listener is not None:
+        _log_listener.stop()
 
 def main():
     try:
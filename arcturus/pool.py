@@ -0,0 +1,22 @@
+# coding=utf-8
+"""worker process pools"""
+
+import contextlib
+import multiprocessing
+import typing
+from multiprocessing.pool import Pool
+
+
+@contextlib.contextmanager
+def worker_pool(processes: typing.Optional[int] = None) -> typing.Generator[Pool, None, None]:
+    """
+    a process pool whose workers are allowed to exit, rather than being terminated, when the block finishes normally.
+    workers log through a queue with a background feeder thread, and a terminated worker loses whatever it hadn't sent
+
+    :param processes:   number of worker processes (defaults to the number of cpus)
+    :return:            the pool
+    """
+    with multiprocessing.Pool(processes) as pool:
+        yield pool
+        pool.close()
+        pool.join()
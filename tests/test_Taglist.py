@@ -2,7 +2,7 @@
 """tests for taglist line processing logic"""
 
 # noinspection PyUnresolvedReferences,PyPep8
-from arcturus.Taglist import Taglist, Query, _ALIAS, _COMMENT_CHAR, _IGNORE_LASTRUN_CHAR
+from arcturus.Taglist import Taglist, Query, CoalescedQuery, _ALIAS, _COMMENT_CHAR, _IGNORE_LASTRUN_CHAR
 from arcturus.Taglist import _IGNORE_LASTRUN_CHAR as FF # for "fast forward"
 from arcturus.Taglist import _COMMENT_CHAR as CC # for "comment char"
 from arcturus.Taglist import _ALIAS as AL # for "ALias"
@@ -61,3 +61,29 @@ def test_taglist():
     assert tl[1] == Query("b", "z", False)
     assert tl[2] == Query("c", "y", True)
     assert tl[3] == Query("a b", None, False)
+
+def test_coalesce_single_tags():
+    queries = Taglist.factory(["a", f"b {AL} y", "c", "d"])
+    coalesced = Taglist.coalesce(queries, max_tags=3)
+
+    assert len(coalesced) == 2
+    assert coalesced[0] == CoalescedQuery("~a ~b ~c", tuple(queries[0:3]), False)
+    assert coalesced[1] == CoalescedQuery("d", (queries[3],), False)
+
+def test_coalesce_keeps_complex_queries():
+    queries = Taglist.factory(["a b", "-a", "rating:s", "a*", "c", "d"])
+    coalesced = Taglist.coalesce(queries, max_tags=6)
+
+    assert [x.text for x in coalesced] == ["a b", "-a", "rating:s", "a*", "~c ~d"]
+    assert all(len(x.members) == 1 for x in coalesced[:4])
+
+def test_coalesce_separates_ignore_lastrun():
+    queries = Taglist.factory(["a", f"{FF} b", "c", f"{FF} d"])
+    coalesced = Taglist.coalesce(queries, max_tags=6)
+
+    assert CoalescedQuery("~a ~c", (queries[0], queries[2]), False) in coalesced
+    assert CoalescedQuery("~b ~d", (queries[1], queries[3]), True) in coalesced
+
+def test_coalesce_disabled_by_limit():
+    queries = Taglist.factory(["a", "b"])
+    assert [x.members for x in Taglist.coalesce(queries, max_tags=1)] == [(queries[0],), (queries[1],)]
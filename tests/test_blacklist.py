@@ -83,3 +83,82 @@ def test_two_line_neg():
     f = Blacklist(blacklist=['-a', '-b'])
     for post in all_posts:
         assert ('a' not in post or 'b' not in post) == f.is_blacklisted(post)
+
+
+def test_or_terms():
+    f = Blacklist(blacklist=['~a ~b'])
+    for post in all_posts:
+        assert ('a' in post or 'b' in post) == f.is_blacklisted(post)
+
+
+def test_pos_and_or_terms():
+    f = Blacklist(blacklist=['c ~a ~b'])
+    for post in all_posts:
+        assert ('c' in post and ('a' in post or 'b' in post)) == f.is_blacklisted(post)
+
+
+def test_blank_and_comment_lines_ignored():
+    f = Blacklist(blacklist=['', '# a comment', 'a'])
+    for post in all_posts:
+        assert ('a' in post) == f.is_blacklisted(post)
+
+
+metadata = [
+    {'rating': 's', 'score': -5, 'ext': 'png'},
+    {'rating': 'q', 'score': 0, 'ext': 'jpg'},
+    {'rating': 'e', 'score': 10, 'ext': 'webm'},
+    {'rating': 'e', 'score': 50, 'ext': 'png'},
+]
+
+
+def test_meta_enum():
+    f = Blacklist(blacklist=['rating:e'])
+    for meta in metadata:
+        assert (meta['rating'] == 'e') == f.is_blacklisted([], meta)
+
+    f = Blacklist(blacklist=['rating:explicit type:png'])
+    for meta in metadata:
+        assert (meta['rating'] == 'e' and meta['ext'] == 'png') == f.is_blacklisted([], meta)
+
+
+def test_meta_numeric():
+    for term, expected in [('score:<0', lambda x: x < 0),
+                           ('score:<=0', lambda x: x <= 0),
+                           ('score:>10', lambda x: x > 10),
+                           ('score:>=10', lambda x: x >= 10),
+                           ('score:10', lambda x: x == 10),
+                           ('score:0..10', lambda x: 0 <= x <= 10)]:
+        f = Blacklist(blacklist=[term])
+        for meta in metadata:
+            assert expected(meta['score']) == f.is_blacklisted([], meta), term
+
+
+def test_meta_negated():
+    f = Blacklist(blacklist=['-rating:s'])
+    for meta in metadata:
+        assert (meta['rating'] != 's') == f.is_blacklisted([], meta)
+
+
+def test_meta_or():
+    f = Blacklist(blacklist=['~type:webm ~score:<0'])
+    for meta in metadata:
+        assert (meta['ext'] == 'webm' or meta['score'] < 0) == f.is_blacklisted([], meta)
+
+
+def test_meta_and_tags():
+    f = Blacklist(blacklist=['a rating:e'])
+    assert f.is_blacklisted(['a'], metadata[2])
+    assert not f.is_blacklisted(['b'], metadata[2])
+    assert not f.is_blacklisted(['a'], metadata[0])
+
+
+def test_meta_missing_metadata_never_matches():
+    for line in ['rating:e', '-rating:e', 'score:<0']:
+        f = Blacklist(blacklist=[line])
+        assert not f.is_blacklisted(['a'])
+
+
+def test_unknown_meta_is_a_tag():
+    f = Blacklist(blacklist=['artist:foo'])
+    assert f.is_blacklisted(['artist:foo'], metadata[0])
+    assert not f.is_blacklisted(['foo'], metadata[0])
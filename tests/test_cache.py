@@ -0,0 +1,86 @@
+# coding=utf-8
+"""tests for the download cache"""
+
+import hashlib
+import json
+
+# noinspection PyUnresolvedReferences,PyPep8
+from arcturus.Cache import Cache, _hash_file
+
+
+def md5(data):
+    return hashlib.md5(data).hexdigest()
+
+
+def make_downloads(path):
+    (path / 'sub').mkdir()
+    (path / 'a.png').write_bytes(b'a' * 1000)
+    (path / 'sub' / 'b.jpg').write_bytes(b'b')
+    (path / 'empty').write_bytes(b'')
+
+
+def test_rebuild(tmp_path):
+    make_downloads(tmp_path)
+    cache = Cache()
+
+    assert cache.rebuild(tmp_path, processes=2) == 3
+    assert len(cache) == 3
+    for data in [b'a' * 1000, b'b', b'']:
+        assert md5(data) in cache
+
+
+def test_rebuild_skips_unchanged(tmp_path):
+    make_downloads(tmp_path)
+    cache = Cache()
+    cache.rebuild(tmp_path, processes=1)
+
+    assert cache.rebuild(tmp_path, processes=1) == 0
+
+    (tmp_path / 'c.gif').write_bytes(b'c')
+    (tmp_path / 'sub' / 'b.jpg').write_bytes(b'changed')
+    assert cache.rebuild(tmp_path, processes=1) == 2
+    assert md5(b'changed') in cache
+    assert md5(b'b') in cache  # previously cached md5s are kept
+
+
+def test_save_and_load(tmp_path):
+    (tmp_path / 'downloads').mkdir()
+    make_downloads(tmp_path / 'downloads')
+    cache = Cache(['x'])
+    cache.rebuild(tmp_path / 'downloads', processes=1)
+    cache.save(tmp_path / '.cache')
+
+    loaded = Cache.load(tmp_path / '.cache')
+    assert len(loaded) == 4
+    assert 'x' in loaded
+    assert loaded.rebuild(tmp_path / 'downloads', processes=1) == 0
+
+
+def test_load_legacy_format(tmp_path):
+    (tmp_path / '.cache').write_text(json.dumps({"cache": ['x', 'y']}))
+    cache = Cache.load(tmp_path / '.cache')
+    assert len(cache) == 2
+    assert 'x' in cache
+
+
+def test_rebuild_skips_part_files(tmp_path):
+    make_downloads(tmp_path)
+    (tmp_path / 'c.gif.part').write_bytes(b'partial')
+    cache = Cache()
+
+    assert cache.rebuild(tmp_path, processes=1) == 3
+    assert md5(b'partial') not in cache
+
+
+def test_rebuild_skips_unreadable(tmp_path):
+    make_downloads(tmp_path)
+    (tmp_path / 'broken.png').symlink_to(tmp_path / 'missing.png')
+    cache = Cache()
+
+    assert cache.rebuild(tmp_path, processes=1) == 3
+    for data in [b'a' * 1000, b'b', b'']:
+        assert md5(data) in cache
+
+
+def test_hash_file_vanished(tmp_path):
+    assert _hash_file(('gone.png', tmp_path / 'gone.png', 10, 0)) == ('gone.png', 10, 0, None)
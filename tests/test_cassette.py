@@ -0,0 +1,150 @@
+# coding=utf-8
+"""tests for recording and replaying source traffic"""
+
+import io
+from datetime import datetime, timezone
+
+# noinspection PyUnresolvedReferences,PyPep8
+from arcturus.ArcturusCore import ArcturusCore, DownloadJob, DownloadResult
+from arcturus.ArcturusSources import e621, replay
+from arcturus.Cassette import Cassette, CassetteRecorder
+from arcturus.FileSink import SyncGroup
+from arcturus.Manifest import Manifest
+from arcturus.Taglist import Taglist
+
+
+def make_metadata(md5, size=100, created_at=1500000000):
+    return {"id": int(md5), "file_url": f"https://example.com/{md5}.png", "file_size": size, "file_ext": "png",
+            "md5": md5, "tags": "a b", "created_at": {"s": created_at}, "rating": "s", "score": 1}
+
+
+class FakeResponse:
+    status_code = 200
+    reason = "OK"
+
+    def __init__(self, body):
+        self._body = body
+
+    def json(self):
+        return self._body
+
+
+class FakeSession:
+    """serves pages keyed by the before_id they are requested with (None for the first page)"""
+
+    def __init__(self, pages):
+        self._pages = pages
+        self.urls = []
+
+    def get(self, url):
+        self.urls.append(url)
+        before_id = int(url.rsplit('=', 1)[1]) if 'before_id=' in url else None
+        return FakeResponse(self._pages.get(before_id, []))
+
+
+def record(pages):
+    fp = io.StringIO()
+    source = e621.source(recorder=CassetteRecorder(fp))
+    source._session = FakeSession(pages)
+    recorded = [x.md5 for x in source.get_posts("a", None)]
+    fp.seek(0)
+    return recorded, Cassette.load(fp)
+
+
+def test_record_pages():
+    pages = {None: [make_metadata('3'), make_metadata('2')], 2: [make_metadata('1')]}
+    recorded, cassette = record(pages)
+
+    assert recorded == ['3', '2', '1']
+    assert cassette.page("a", None)[0] == pages[None]
+    assert cassette.page("a", 2)[0] == pages[2]
+    assert cassette.page("a", 1)[0] == []  # the empty page which ended the listing is recorded too
+    assert cassette.page("b", None) is None
+
+
+def test_pages_by_id():
+    source = e621.source()
+    source._session = FakeSession({None: [make_metadata('9'), make_metadata('7')], 7: [make_metadata('4')]})
+
+    # each page continues below the lowest id of the one before, and its cursor is that id
+    assert [(cursor, [x.md5 for x in posts]) for cursor, posts in source.get_pages("a", None)] == \
+        [(7, ['9', '7']), (4, ['4'])]
+    assert source._session.urls[1].endswith("tags=a&before_id=7")
+
+    # resuming after a page asks for the posts below it, whatever has been posted since
+    assert [x.md5 for _, posts in source.get_pages("a", None, after=7) for x in posts] == ['4']
+
+
+def test_pages_stop_at_lastrun():
+    source = e621.source()
+    source._session = FakeSession({None: [make_metadata('9', created_at=300), make_metadata('8', created_at=200)],
+                                   8: [make_metadata('7', created_at=150), make_metadata('6', created_at=50)],
+                                   6: [make_metadata('5', created_at=40)]})
+    lastrun = datetime.fromtimestamp(100, tz=timezone.utc)
+
+    # the second page reaches back past lastrun, so the third is never requested
+    assert [x.md5 for x in source.get_posts("a", None, lastrun)] == ['9', '8', '7']
+    assert len(source._session.urls) == 2
+
+
+def test_replay_plan():
+    pages = {None: [make_metadata('3'), make_metadata('2')], 2: [make_metadata('1')]}
+    _, cassette = record(pages)
+
+    core = ArcturusCore(replay.source(cassette=cassette, speed=0), Taglist.factory(["a", "b"]), "downloads", None,
+                        None, None)
+    manifest = io.StringIO()
+    assert core.plan(manifest) == 3
+
+    manifest.seek(0)
+    assert [x.md5 for x in Manifest.read(manifest)] == ['3', '2', '1']
+
+
+def test_record_and_replay_files(tmp_path):
+    fp = io.StringIO()
+    recorder = CassetteRecorder(fp)
+    recorder.record_file(DownloadResult("https://example.com/1.png", tmp_path / "1.png", 3000000, 0.5))
+    fp.seek(0)
+    cassette = Cassette.load(fp)
+
+    assert cassette.bytes_per_second == 6000000
+
+    # the recorded size is replayed, whatever size the post claims
+    download = cassette.downloader(speed=0, synthetic=True)
+    result = download(DownloadJob("https://example.com/1.png", tmp_path / "1.png", None))
+    assert result.size == 3000000
+
+    sync = SyncGroup()
+    sync.add(result.destination)
+    sync.commit()
+    assert (tmp_path / "1.png").stat().st_size == 3000000
+
+
+def test_replay_recorded_duration(tmp_path):
+    cassette = Cassette({}, {"https://example.com/slow.png": (10, 0.2), "https://example.com/fast.png": (10 ** 6, 0.0)})
+
+    # each file takes as long as it did when recorded, not as long as the average throughput says
+    download = cassette.downloader(speed=2)
+    assert download(DownloadJob("https://example.com/slow.png", tmp_path / "slow.png", None)).elapsed >= 0.1
+    assert download(DownloadJob("https://example.com/fast.png", tmp_path / "fast.png", None)).elapsed < 0.1
+
+
+def test_replay_without_synthetic_files(tmp_path):
+    download = Cassette({}, {}).downloader(speed=0)
+    result = download(DownloadJob("https://example.com/1.png", tmp_path / "1.png", 100))
+    assert result.destination is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_replay_update_with_pending(tmp_path):
+    pages = {None: [make_metadata('3'), make_metadata('2')], 2: [make_metadata('1')]}
+    _, cassette = record(pages)
+
+    core = ArcturusCore(replay.source(cassette=cassette, speed=0), Taglist.factory(["a"]), tmp_path / "downloads",
+                        None, None, None, download_nameformat="${md5}.${ext}", pending_dir=tmp_path / "pending",
+                        download_batch_size=2)
+    (tmp_path / "downloads").mkdir()
+    assert core.update(download_method=cassette.downloader(speed=0, synthetic=True)) == 3
+
+    assert sorted(x.name for x in (tmp_path / "downloads").iterdir()) == ["1.png", "2.png", "3.png"]
+    assert not (tmp_path / "pending").exists()
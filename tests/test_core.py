@@ -0,0 +1,184 @@
+# coding=utf-8
+"""tests for downloading, planning and executing in ArcturusCore"""
+
+import io
+
+import pytest
+import requests
+
+# noinspection PyUnresolvedReferences,PyPep8
+import arcturus.ArcturusCore
+from arcturus.ArcturusCore import ArcturusCore, DownloadJob, DownloadResult, _download_single
+from arcturus.ArcturusSources.Source import Source
+from arcturus.FileSink import part_path, write_part
+from arcturus.Manifest import Manifest
+from arcturus.Cache import Cache
+from arcturus.Post import Post, Variant, ORIGINAL, SAMPLE
+from arcturus.SizePolicy import SizePolicy
+from arcturus.Taglist import Taglist
+
+
+def make_post(name, tags=("a",)):
+    return Post(url=f"https://example.com/{name}.png", tags=list(tags), md5=name, filename=f"{name}.png", ext="png")
+
+
+class FakeSource(Source):
+    """lists fixed posts for each query"""
+
+    def __init__(self, listings):
+        super().__init__()
+        self._listings = listings
+        self.queries = []
+
+    def get_posts(self, query, alias, lastrun=None):
+        self.queries.append(query)
+        for post in self._listings.get(query, []):
+            yield post.for_query(query, alias)
+
+
+class FakeOrSource(FakeSource):
+    """a fake source which, like e621, accepts several '~' tags in one query"""
+
+    @property
+    def max_query_tags(self):
+        return 6
+
+
+def fake_download(job):
+    """writes the url as the file's contents.  urls containing 'bad' fail, like a deleted post"""
+    if 'bad' in job.url:
+        raise ConnectionError(f"can't fetch {job.url}")
+    _, written = write_part(job.destination, [job.url.encode()])
+    return DownloadResult(job.url, job.destination, written, 0.0)
+
+
+def make_core(tmp_path, listings, taglist=("a",), cache=None, **kwargs):
+    kwargs.setdefault('download_nameformat', "${md5}.${ext}")
+    (tmp_path / "downloads").mkdir(exist_ok=True)
+    return ArcturusCore(FakeSource(listings), Taglist.factory(taglist), tmp_path / "downloads", None, None, cache,
+                        download_threads=2, **kwargs)
+
+
+def downloaded(tmp_path):
+    return sorted(x.name for x in (tmp_path / "downloads").iterdir())
+
+
+class StubResponse:
+    """stands in for a streamed requests 2.17 response, which is not a context manager"""
+
+    def __init__(self, body, status_code=200):
+        self._body = body
+        self.status_code = status_code
+        self.headers = {'Content-Length': str(len(body))}
+        self.closed = False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error")
+
+    def iter_content(self, chunk_size=1):
+        for offset in range(0, len(self._body), chunk_size):
+            yield self._body[offset:offset + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def stub_get(monkeypatch):
+    responses = {}
+    monkeypatch.setattr(arcturus.ArcturusCore.requests, 'get', lambda url, stream=False: responses[url])
+    return responses
+
+
+def test_download_single(tmp_path, stub_get):
+    response = stub_get["https://example.com/a.png"] = StubResponse(b'abc' * 100000)
+
+    result = _download_single(DownloadJob("https://example.com/a.png", tmp_path / "a.png", None))
+    assert result.size == 300000
+    assert part_path(tmp_path / "a.png").read_bytes() == b'abc' * 100000
+    assert response.closed
+
+
+def test_download_single_error(tmp_path, stub_get):
+    response = stub_get["https://example.com/a.png"] = StubResponse(b'', status_code=404)
+
+    with pytest.raises(requests.HTTPError):
+        _download_single(DownloadJob("https://example.com/a.png", tmp_path / "a.png", None))
+    assert response.closed
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_update_skips_failed_downloads(tmp_path):
+    listings = {"a": [make_post("1"), make_post("bad"), make_post("2")]}
+    core = make_core(tmp_path, listings, pending_dir=tmp_path / "pending", download_batch_size=2)
+
+    # the failed file doesn't stop its batch from being checkpointed, so the queue still drains
+    assert core.update(download_method=fake_download) == 2
+    assert downloaded(tmp_path) == ["1.png", "2.png"]
+    assert not (tmp_path / "pending").exists()
+
+
+def test_execute_skips_failed_downloads(tmp_path):
+    manifest = tmp_path / "manifest.jsonl"
+    with open(manifest, 'w') as fp:
+        make_core(tmp_path, {"a": [make_post("1"), make_post("bad"), make_post("2")]}).plan(fp)
+
+    assert make_core(tmp_path, {}).execute([manifest], download_method=fake_download) == 2
+    assert downloaded(tmp_path) == ["1.png", "2.png"]
+
+
+def test_plan(tmp_path):
+    core = make_core(tmp_path, {"a": [make_post("1"), make_post("2")], "b": [make_post("3", tags=["b"])]},
+                     taglist=("a", "b"))
+    manifest = io.StringIO()
+    assert core.plan(manifest) == 3
+    assert downloaded(tmp_path) == []
+
+    manifest.seek(0)
+    assert [(x.md5, x.query) for x in Manifest.read(manifest)] == [("1", "a"), ("2", "a"), ("3", "b")]
+
+
+def test_execute_retry(tmp_path):
+    manifest = tmp_path / "manifest.jsonl"
+    with open(manifest, 'w') as fp:
+        make_core(tmp_path, {"a": [make_post("1"), make_post("2"), make_post("3")]}).plan(fp)
+
+    core = make_core(tmp_path, {})
+    assert core.execute([manifest], download_method=fake_download) == 3
+    assert downloaded(tmp_path) == ["1.png", "2.png", "3.png"]
+
+    # retrying only fetches what is missing
+    (tmp_path / "downloads" / "2.png").unlink()
+    assert core.execute([manifest], download_method=fake_download) == 1
+    assert downloaded(tmp_path) == ["1.png", "2.png", "3.png"]
+
+
+def test_committed_downloads_cached(tmp_path):
+    post = Post(url="https://example.com/1.png", tags=["a"], md5="1", filename="1.png", ext="png", file_size=5000,
+                variants={ORIGINAL: Variant("https://example.com/1.png", 5000, 2000, 2000),
+                          SAMPLE: Variant("https://example.com/sample/1.jpg", None, 850, 850)})
+    cache = Cache()
+    core = make_core(tmp_path, {"a": [post]}, cache=cache, size_policy=SizePolicy(max_file_size=1000))
+
+    # the sample's content has a different md5, but the listed post's md5 is what the cache needs to recognize it
+    assert core.update(download_method=fake_download) == 1
+    assert downloaded(tmp_path) == ["1.jpg"]
+    assert "1" in cache
+    assert core.update(download_method=fake_download) == 0
+
+
+def test_coalesced_listing_split(tmp_path):
+    listings = {"~Cat ~dog": [make_post("1", tags=["cat"]), make_post("2", tags=["cat", "dog"]),
+                              make_post("3", tags=["dog"]), make_post("4", tags=["other"])]}
+    source = FakeOrSource(listings)
+    core = ArcturusCore(source, Taglist.factory(["Cat ~ kitties", "dog"]), tmp_path, None, None, None,
+                        query_coalescing=True)
+    manifest = io.StringIO()
+    core.plan(manifest)
+
+    # one request for both queries.  each post is credited to every member whose tag it has, whatever its case
+    assert source.queries == ["~Cat ~dog"]
+    manifest.seek(0)
+    assert [(x.md5, x.query, x.alias) for x in Manifest.read(manifest)] == \
+        [("1", "Cat", "kitties"), ("2", "Cat", "kitties"), ("2", "dog", None), ("3", "dog", None)]
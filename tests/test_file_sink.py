@@ -0,0 +1,97 @@
+# coding=utf-8
+"""tests for writing downloaded files to disk"""
+
+import pytest
+
+# noinspection PyUnresolvedReferences,PyPep8
+from arcturus import FileSink
+from arcturus.FileSink import SyncGroup, part_path, write_part
+
+
+def test_write_part(tmp_path):
+    destination = tmp_path / "a.png"
+    path, written = write_part(destination, [b'abc', b'', b'def'], size=6, buffer_chunks=1)
+
+    assert path == part_path(destination) == tmp_path / "a.png.part"
+    assert written == 6
+    assert path.read_bytes() == b'abcdef'
+    assert not destination.exists()
+
+
+def test_write_part_shorter_than_expected(tmp_path):
+    path, written = write_part(tmp_path / "a.png", [b'abc'], size=1000)
+    assert written == 3
+    assert path.stat().st_size == 3  # preallocated space is released
+
+
+def test_write_part_source_error(tmp_path):
+    def chunks():
+        yield b'abc'
+        raise ConnectionError("dropped")
+
+    with pytest.raises(ConnectionError):
+        write_part(tmp_path / "a.png", chunks())
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_write_part_writer_error(tmp_path):
+    # anything the writer thread raises is passed to the caller, not only OSError
+    with pytest.raises(TypeError):
+        write_part(tmp_path / "a.png", ["not bytes"])
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_sync_group_commit(tmp_path):
+    sync = SyncGroup(batch_size=10)
+    for name in ["a.png", "b.png"]:
+        write_part(tmp_path / name, [name.encode()])
+        sync.add(tmp_path / name)
+
+    assert len(sync) == 2
+    assert not (tmp_path / "a.png").exists()
+
+    sync.commit()
+    assert len(sync) == 0
+    assert sorted(x.name for x in tmp_path.iterdir()) == ["a.png", "b.png"]
+    assert (tmp_path / "b.png").read_bytes() == b'b.png'
+
+
+def test_sync_group_duplicates(tmp_path):
+    sync = SyncGroup(batch_size=10)
+    write_part(tmp_path / "a.png", [b'a'])
+    sync.add(tmp_path / "a.png")
+    sync.add(tmp_path / "a.png")
+
+    assert len(sync) == 1
+    sync.commit()
+    assert (tmp_path / "a.png").read_bytes() == b'a'
+
+
+def test_sync_group_batch_size(tmp_path):
+    sync = SyncGroup(batch_size=2)
+    for name in ["a.png", "b.png", "c.png"]:
+        write_part(tmp_path / name, [b'x'])
+        sync.add(tmp_path / name)
+
+    assert (tmp_path / "a.png").exists() and (tmp_path / "b.png").exists()
+    assert not (tmp_path / "c.png").exists()
+    assert len(sync) == 1
+
+
+def test_sync_group_commit_without_syncfs(tmp_path, monkeypatch):
+    # platforms without syncfs sync each file instead
+    monkeypatch.setattr(FileSink, '_syncfs', None)
+    sync = SyncGroup(batch_size=10)
+    write_part(tmp_path / "a.png", [b'a'])
+    sync.add(tmp_path / "a.png")
+    sync.commit()
+    assert (tmp_path / "a.png").read_bytes() == b'a'
+
+
+def test_sync_group_on_commit(tmp_path):
+    committed = []
+    sync = SyncGroup(batch_size=2, on_commit=committed.append)
+    for name in ["a.png", "b.png"]:
+        write_part(tmp_path / name, [name.encode()])
+        sync.add(tmp_path / name)
+    assert committed == [[tmp_path / "a.png", tmp_path / "b.png"]]
@@ -0,0 +1,72 @@
+# coding=utf-8
+"""tests for logging setup helpers"""
+
+import logging
+import pickle
+import queue
+import sys
+
+# noinspection PyUnresolvedReferences,PyPep8
+from arcturus.cli import LoggingRateLimit, LoggingCodeLocation, LoggingQueueHandler
+
+
+def make_record(level=logging.DEBUG, lineno=1, msg="message", args=None, exc_info=None):
+    return logging.LogRecord("test", level, "/src/module.py", lineno, msg, args, exc_info, func="function")
+
+
+def test_rate_limit_burst():
+    f = LoggingRateLimit(burst=3, interval=60)
+    assert [f.filter(make_record()) for _ in range(5)] == [True, True, True, False, False]
+
+
+def test_rate_limit_per_call_site():
+    f = LoggingRateLimit(burst=1, interval=60)
+    assert f.filter(make_record(lineno=1))
+    assert f.filter(make_record(lineno=2))
+    assert not f.filter(make_record(lineno=1))
+
+
+def test_rate_limit_only_debug():
+    f = LoggingRateLimit(burst=1, interval=60)
+    assert all(f.filter(make_record(level=logging.INFO)) for _ in range(5))
+
+
+def test_rate_limit_reports_dropped():
+    f = LoggingRateLimit(burst=1, interval=60)
+    f.filter(make_record())
+    f.filter(make_record())
+    f.filter(make_record())
+    f._interval = 0  # next record starts a new window
+
+    record = make_record()
+    assert f.filter(record)
+    assert record.msg == "message (2 similar messages dropped)"
+
+
+def test_code_location_formatter():
+    formatter = LoggingCodeLocation(fmt='%(code_location)s %(message)s')
+    assert formatter.format(make_record(lineno=42)) == "[module:function:42] message"
+
+
+def test_queue_handler_defers_formatting():
+    handler = LoggingQueueHandler(queue.Queue())
+    record = make_record(msg="%d posts from %s", args=(3, "a"))
+
+    prepared = handler.prepare(record)
+    assert prepared is not record
+    assert (prepared.msg, prepared.args) == ("%d posts from %s", (3, "a"))
+    assert pickle.loads(pickle.dumps(prepared)).getMessage() == "3 posts from a"
+
+
+def test_queue_handler_formats_unpicklable():
+    handler = LoggingQueueHandler(queue.Queue())
+    try:
+        raise ValueError("bad")
+    except ValueError:
+        record = make_record(msg="lock %s", args=(handler.lock,), exc_info=sys.exc_info())
+
+    prepared = pickle.loads(pickle.dumps(handler.prepare(record)))
+    assert prepared.msg.startswith("lock <")
+    assert prepared.args is None
+    assert "ValueError: bad" in prepared.exc_text
+    assert record.exc_info is not None  # the caller's record is left alone
@@ -0,0 +1,46 @@
+# coding=utf-8
+"""tests for manifest reading and writing"""
+
+import io
+
+# noinspection PyUnresolvedReferences,PyPep8
+from arcturus.Manifest import Manifest
+from arcturus.Post import Post
+
+posts = [
+    Post(url="https://example.com/a.png", tags=['a', 'b'], md5="aaaa", filename="a.png", ext="png"),
+    Post(url="https://example.com/b.jpg", tags=['c'], md5="bbbb", filename="b.jpg", ext="jpg", query="c", alias="z"),
+]
+
+
+def test_round_trip():
+    fp = io.StringIO()
+    assert Manifest.write(posts, fp) == len(posts)
+
+    fp.seek(0)
+    read_back = list(Manifest.read(fp))
+
+    assert [x.to_dict() for x in read_back] == [x.to_dict() for x in posts]
+
+
+def test_one_post_per_line():
+    fp = io.StringIO()
+    Manifest.write(posts, fp)
+    assert len(fp.getvalue().splitlines()) == len(posts)
+
+
+def test_streams_lazily():
+    def generator():
+        yield posts[0]
+        assert fp.getvalue().count('\n') == 1  # first post already written before the second is produced
+        yield posts[1]
+
+    fp = io.StringIO()
+    assert Manifest.write(generator(), fp) == 2
+
+
+def test_blank_lines_skipped():
+    fp = io.StringIO()
+    Manifest.write(posts, fp)
+    lines = io.StringIO('\n' + fp.getvalue().replace('\n', '\n\n'))
+    assert len(list(Manifest.read(lines))) == len(posts)
@@ -0,0 +1,115 @@
+# coding=utf-8
+"""tests for the on-disk pending download queue"""
+
+import threading
+
+# noinspection PyUnresolvedReferences,PyPep8
+from arcturus.PendingQueue import PendingQueue
+from arcturus.Post import Post
+
+
+def make_posts(prefix, count):
+    return [Post(url=f"https://example.com/{prefix}{i}.png", tags=[prefix], md5=f"{prefix}{i}",
+                 filename=f"{prefix}{i}.png", ext="png") for i in range(count)]
+
+
+def md5s(batches):
+    return [post.md5 for batch in batches for post in batch]
+
+
+def test_progress(tmp_path):
+    pending = PendingQueue(tmp_path / 'pending')
+    assert not pending.resumed
+    assert pending.progress('a') == (None, False)
+
+    pending.append(make_posts('a', 2), 'a', 1)
+    assert pending.progress('a') == (1, False)
+    pending.finish('a')
+    assert pending.progress('a') == (1, True)
+
+
+def test_batches(tmp_path):
+    pending = PendingQueue(tmp_path / 'pending')
+    pending.append(make_posts('a', 5), 'a', 1)
+    pending.end_listing()
+
+    batches = list(pending.batches(2))
+    assert [len(x) for x in batches] == [2, 2, 1]
+    assert md5s(batches) == [f"a{i}" for i in range(5)]
+
+
+def test_resume_listing(tmp_path):
+    pending = PendingQueue(tmp_path / 'pending')
+    pending.append(make_posts('a', 3), 'a', 1)
+    pending.close()
+
+    resumed = PendingQueue(tmp_path / 'pending')
+    assert resumed.resumed
+    assert resumed.progress('a') == (1, False)
+    resumed.append(make_posts('b', 1), 'a', 2)
+    resumed.end_listing()
+    assert md5s(resumed.batches(10)) == ['a0', 'a1', 'a2', 'b0']
+
+
+def test_resume_charged(tmp_path):
+    pending = PendingQueue(tmp_path / 'pending')
+    assert pending.charged == 0
+    pending.append(make_posts('a', 1), 'a', 1, charged=1000)
+    pending.finish('a')
+    pending.close()
+
+    assert PendingQueue(tmp_path / 'pending').charged == 1000
+
+
+def test_partial_write_discarded(tmp_path):
+    pending = PendingQueue(tmp_path / 'pending')
+    pending.append(make_posts('a', 2), 'a', 1)
+    pending.close()
+
+    # simulate a crash part way through writing the next page
+    with open(tmp_path / 'pending' / 'queue.jsonl', 'a') as fp:
+        fp.write('{"url": "https://exa')
+
+    resumed = PendingQueue(tmp_path / 'pending')
+    resumed.end_listing()
+    assert md5s(resumed.batches(10)) == ['a0', 'a1']
+
+
+def test_resume_downloading(tmp_path):
+    pending = PendingQueue(tmp_path / 'pending')
+    pending.append(make_posts('a', 5), 'a', 1)
+
+    batches = pending.batches(2)
+    next(batches)
+    next(batches)  # first batch is checkpointed as done once the second is requested
+    pending.close()
+
+    resumed = PendingQueue(tmp_path / 'pending')
+    resumed.end_listing()
+    assert md5s(resumed.batches(2)) == ['a2', 'a3', 'a4']
+
+
+def test_batches_while_listing(tmp_path):
+    pending = PendingQueue(tmp_path / 'pending')
+    pending.append(make_posts('a', 2), 'a', 1)
+
+    # the first batch is downloaded while the listing is still appending
+    batches = pending.batches(2)
+    assert md5s([next(batches)]) == ['a0', 'a1']
+
+    def lister():
+        pending.append(make_posts('b', 3), 'b', 1)
+        pending.finish('b')
+        pending.end_listing()
+
+    thread = threading.Thread(target=lister)
+    thread.start()
+    assert md5s(batches) == ['b0', 'b1', 'b2']
+    thread.join()
+
+
+def test_clear(tmp_path):
+    pending = PendingQueue(tmp_path / 'pending')
+    pending.append(make_posts('a', 1), 'a', 1)
+    pending.clear()
+    assert not (tmp_path / 'pending').exists()
@@ -0,0 +1,98 @@
+# coding=utf-8
+"""tests for the local post index"""
+
+from datetime import datetime, timezone
+
+import pytest
+
+# noinspection PyUnresolvedReferences,PyPep8
+from arcturus.PostIndex import PostIndex
+from arcturus.Post import Post
+
+
+def make_post(md5, tags, created_at=0, rating="s", score=0):
+    return Post(url=f"https://example.com/{md5}.png", tags=tags, md5=md5, filename=f"{md5}.png", ext="png",
+                query="ignored", alias="ignored", created_at=created_at, rating=rating, score=score)
+
+
+def make_index():
+    index = PostIndex(':memory:')
+    index.add(make_post('1', ['a'], created_at=100, rating="e", score=5))
+    index.add(make_post('2', ['a', 'b'], created_at=200))
+    index.add(make_post('3', ['b', 'c'], created_at=300, score=-1))
+    index.add(make_post('4', ['cat_ears'], created_at=400, rating="q"))
+    index.flush()
+    return index
+
+
+def md5s(posts):
+    return sorted(x.md5 for x in posts)
+
+
+def test_add():
+    index = make_index()
+    assert len(index) == 4
+    assert '1' in index
+    assert '5' not in index
+
+
+def test_replace():
+    index = make_index()
+    index.add(make_post('1', ['z']))
+    assert len(index) == 4
+    assert md5s(index.query('a')) == ['2']
+    assert md5s(index.query('z')) == ['1']
+
+
+def test_query_and_not():
+    index = make_index()
+    assert md5s(index.query('a')) == ['1', '2']
+    assert md5s(index.query('a b')) == ['2']
+    assert md5s(index.query('b -a')) == ['3']
+    assert md5s(index.query('A')) == ['1', '2']
+
+
+def test_query_or():
+    index = make_index()
+    assert md5s(index.query('~a ~c')) == ['1', '2', '3']
+    assert md5s(index.query('b ~a ~c')) == ['2', '3']
+
+
+def test_query_wildcard():
+    index = make_index()
+    assert md5s(index.query('cat*')) == ['4']
+
+
+def test_query_lastrun():
+    index = make_index()
+    lastrun = datetime.fromtimestamp(150, tz=timezone.utc)
+    assert md5s(index.query('a', lastrun)) == ['2']
+
+
+def test_query_and_alias_not_stored():
+    index = make_index()
+    post = next(index.query('c'))
+    assert post.query is None and post.alias is None
+    assert post.created_at == 300
+
+
+def test_query_meta():
+    index = make_index()
+    assert md5s(index.query('rating:s')) == ['2', '3']
+    assert md5s(index.query('a rating:s')) == ['2']
+    assert md5s(index.query('a -rating:s')) == ['1']
+    assert md5s(index.query('score:<0')) == ['3']
+    assert md5s(index.query('~rating:q ~a')) == ['1', '2', '4']
+
+
+def test_query_unsupported_meta():
+    index = make_index()
+    with pytest.raises(ValueError):
+        index.query('a order:score')
+
+
+def test_query_order_stable():
+    index = PostIndex(':memory:')
+    for md5 in ['c', 'a', 'b']:
+        index.add(make_post(md5, ['a'], created_at=100))
+    assert [x.md5 for x in index.query('a')] == ['a', 'b', 'c']
@@ -0,0 +1,91 @@
+# coding=utf-8
+"""tests for variant selection and byte budgets"""
+
+# noinspection PyUnresolvedReferences,PyPep8
+from arcturus.SizePolicy import SizePolicy
+from arcturus.Post import Post, Variant, ORIGINAL, SAMPLE, PREVIEW
+
+
+def make_post(size, query="q", alias=None, sample=True):
+    variants = {ORIGINAL: Variant("https://example.com/a.png", size, 2000, 2000)}
+    if sample:
+        variants[SAMPLE] = Variant("https://example.com/sample/a.jpg", None, 850, 850)
+    variants[PREVIEW] = Variant("https://example.com/preview/a.jpg", 10, 150, 150)
+    return Post(url="https://example.com/a.png", tags=[], md5="a", filename="a.png", ext="png", query=query,
+                alias=alias, file_size=size, variants=variants)
+
+
+def test_no_limits():
+    post = make_post(10 ** 9)
+    assert SizePolicy().select(post) is post
+
+
+def test_original_fits():
+    assert SizePolicy(max_file_size=1000).select(make_post(1000)).variant == ORIGINAL
+
+
+def test_falls_back_to_sample():
+    chosen = SizePolicy(max_file_size=1000).select(make_post(1001))
+    assert chosen.variant == SAMPLE
+    assert chosen.url == "https://example.com/sample/a.jpg"
+    assert chosen.ext == "jpg"
+    assert chosen.filename == "a.jpg"
+    assert chosen.md5 == "a"
+
+
+def test_falls_back_to_preview():
+    assert SizePolicy(max_file_size=1000).select(make_post(1001, sample=False)).variant == PREVIEW
+
+
+def test_nothing_fits():
+    assert SizePolicy(max_file_size=5).select(make_post(1001, sample=False)) is None
+
+
+def test_query_cap_overrides_global():
+    policy = SizePolicy(max_file_size=1000, query_max_file_size={"big": 0, "q": 10})
+    assert policy.select(make_post(5000, alias="big")).variant == ORIGINAL
+    assert policy.select(make_post(5000, query="q", sample=False)).variant == PREVIEW
+    assert policy.select(make_post(5000, query="other")).variant == SAMPLE
+
+
+def test_byte_budget():
+    policy = SizePolicy(byte_budget=2500)
+    assert policy.select(make_post(1000)).variant == ORIGINAL
+    assert policy.select(make_post(1000)).variant == ORIGINAL
+    assert policy.remaining == 500
+    assert policy.select(make_post(1000, sample=False)).variant == PREVIEW
+    assert policy.remaining == 490
+
+
+def test_byte_budget_used_up():
+    policy = SizePolicy(byte_budget=1000)
+    assert policy.select(make_post(1000)).variant == ORIGINAL
+    assert policy.remaining == 0
+
+    # the sample's size is unknown, but nothing more may be downloaded
+    assert policy.select(make_post(1000, sample=True)) is None
+    assert policy.select(make_post(1, sample=True)) is None
+
+
+def test_byte_budget_unknown_size():
+    # the sample is charged as if it were as large as the original
+    policy = SizePolicy(max_file_size=1000, byte_budget=3000)
+    assert policy.select(make_post(2000)).variant == SAMPLE
+    assert policy.spent == 2000
+
+    # a file with no known size can't be charged, so it isn't downloaded under a budget
+    post = Post(url="https://example.com/b.png", tags=[], md5="b", filename="b.png", ext="png")
+    assert policy.select(post) is None
+    assert SizePolicy(max_file_size=1000).select(post) is post
+
+
+def test_byte_budget_charge():
+    policy = SizePolicy(byte_budget=1500)
+    policy.charge(1000)
+    assert policy.remaining == 500
+    assert policy.select(make_post(1000, sample=False)).variant == PREVIEW
+
+
+def test_variants_round_trip():
+    post = make_post(1000)
+    assert Post.from_dict(post.to_dict()).variants == post.variants